@@ -1,6 +1,13 @@
 """
 This module implements a parser and includes a unit test for that parser.
 """
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import io
+import os
+import re
+import sys
+
 from lexer import Token,Lexer
 from interpreter import *
 
@@ -10,6 +17,9 @@ class Parser:
         self.lexer = lexer
         self.errors = 0
 
+        # skip function bodies, leaving them to be parsed on first call
+        self.lazy = False
+
 
     def next(self):
         self.lexer.next()
@@ -72,13 +82,28 @@ class Parser:
         < Function-Def >    ::= < Signature > < Block >
         """
 
-        fun_def = ParseNode(eval_function_def, [])
+        start = self.lexer.cur_tok
+        fun_def = ParseNode(eval_function_def, [], (start.line, start.col))
         self.parse_signature(fun_def)
 
-        fun_def.child.append(self.parse_block())
+        if self.lazy and self.match(Token.BEGIN):
+            fun_def.child.append(self.skip_block())
+        else:
+            fun_def.child.append(self.parse_block())
         return fun_def
 
 
+    def skip_block(self):
+        """
+        Skip a block without parsing it, and return a lazy body node
+        holding its source text and where that starts.
+        """
+        begin = self.lexer.cur_tok
+        text = self.lexer.skip_block()
+        self.must_be(Token.END, "Mismatched Braces")
+        return ParseNode(eval_lazy_body, [text, begin.line, begin.col, type(self)])
+
+
     def parse_signature(self, fun_def):
 
         t = self.parse_type()
@@ -127,8 +152,9 @@ class Parser:
     def parse_statement_list(self, block):
         block.child.append(self.parse_statement())
 
-        first = (Token.REAL, Token.INT, Token.IDENTIFIER, Token.INTNUM, 
-                 Token.REALNUM, Token.LPAREN, Token.WHILE, Token.IF)
+        first = (Token.REAL, Token.INT, Token.MAP, Token.IDENTIFIER, Token.INTNUM, 
+                 Token.REALNUM, Token.LPAREN, Token.WHILE, Token.PARFOR,
+                 Token.IF)
         while self.match(first):
             block.child.append(self.parse_statement())
 
@@ -138,12 +164,16 @@ class Parser:
         
         semi = False 
         result = None
+        start = self.lexer.cur_tok
+        pos = (start.line, start.col)
 
-        if self.match((Token.REAL, Token.INT)):
+        if self.match((Token.REAL, Token.INT, Token.MAP)):
             semi = True
-            result = ParseNode(eval_decl, self.parse_decl())
+            result = ParseNode(eval_decl, self.parse_decl(), pos)
         elif self.match(Token.WHILE):
             result = self.parse_while()
+        elif self.match(Token.PARFOR):
+            result = self.parse_parfor()
         elif self.match(Token.IF):
             result = self.parse_if()
         elif self.match(Token.IDENTIFIER):
@@ -152,15 +182,24 @@ class Parser:
             self.next()
 
             semi = True
+            target = self.parse_subscripts(ParseNode(eval_identifier, [name_token.lex], pos))
+
             # Statement'
             if self.have(Token.ASSIGN):
-                result = ParseNode(eval_assign, [name_token.lex, self.parse_expr()])
+                if target.eval == eval_identifier:
+                    result = ParseNode(eval_assign, [name_token.lex, self.parse_expr()], pos)
+                else:
+                    result = ParseNode(eval_store, [target, self.parse_expr()], pos)
             elif self.have(Token.SWAP):
-                result = ParseNode(eval_swap, [name_token.lex, self.parse_expr()])
-            elif self.have(Token.LPAREN):
-                result = self.parse_call2(name_token.lex)
+                if target.eval not in (eval_identifier, eval_index):
+                    self.errors += 1
+                    print("Error: Expected Variable %s:\"%s\" at Line %d Column %d"%(
+                        name_token.token, name_token.lex, name_token.line, name_token.col))
+                result = ParseNode(eval_swap, [target, self.parse_swap_target()], pos)
+            elif target.eval == eval_identifier and self.have(Token.LPAREN):
+                result = self.parse_call2(name_token.lex, pos)
             else:
-                result = self.parse_expr2(ParseNode(eval_identifier, [name_token.lex]))
+                result = self.parse_expr2(target)
         else:
             semi = True
             result = self.parse_expr()
@@ -171,27 +210,85 @@ class Parser:
         return result
 
 
-    def parse_call2(self, identifier):
+    def parse_call2(self, identifier, pos=None):
 
         if self.have(Token.RPAREN):
             args=[]
         else:
             args = self.parse_args()
-        self.must_be(Token.RPAREN, "Mismatched Parenthesis")
+            self.must_be(Token.RPAREN, "Mismatched Parenthesis")
+
+        return ParseNode(eval_call, [identifier, *args], pos)
 
-        return ParseNode(eval_call, [identifier, *args])
+
+    def parse_swap_target(self):
+
+        error_tok = self.lexer.cur_tok
+        result = self.parse_value()
+        if result.eval not in (eval_identifier, eval_index):
+            self.errors += 1
+            print("Error: Expected Variable %s:\"%s\" at Line %d Column %d"%(
+                error_tok.token, error_tok.lex, error_tok.line, error_tok.col))
+        return result
+
+
+    def parse_subscripts(self, base):
+        """
+        < Subscripts >  ::= [ < Expr > ] < Subscripts >
+                          | [ < Expr >? : < Expr >? ] < Subscripts >
+                          | ""
+        """
+
+        result = base
+        while self.have(Token.LBRACKET):
+            start = None
+            if not self.match(Token.COLON):
+                start = self.parse_expr()
+
+            if self.have(Token.COLON):
+                stop = None
+                if not self.match(Token.RBRACKET):
+                    stop = self.parse_expr()
+                result = ParseNode(eval_slice, [result, start, stop])
+            else:
+                result = ParseNode(eval_index, [result, start])
+            self.must_be(Token.RBRACKET, "Mismatched Brackets")
+        return result
 
 
     def parse_decl(self):
 
+        # maps are only variables and parameters, never function types
+        if self.have(Token.MAP):
+            name_token = self.lexer.cur_tok
+            self.must_be(Token.IDENTIFIER)
+            return (SymType.VAR_MAP, name_token.lex)
+
         t = self.parse_type()
-        if t == Token.INT:
-            t = SymType.VAR_INT
-        else:
-            t = SymType.VAR_REAL
 
         name_token = self.lexer.cur_tok
         self.must_be(Token.IDENTIFIER)
+
+        # array declarations may give a size, which is only informational
+        # since arrays grow as elements are inserted, while matrices are
+        # allocated with the rows and columns they are declared with
+        dims = []
+        while len(dims) < 2 and self.have(Token.LBRACKET):
+            if self.match(Token.RBRACKET):
+                dims.append(None)
+            else:
+                dims.append(self.parse_expr())
+            self.must_be(Token.RBRACKET, "Mismatched Brackets")
+
+        if len(dims) == 2:
+            t = SymType.MATRIX_INT if t == Token.INT else SymType.MATRIX_REAL
+            if None in dims:
+                return (t, name_token.lex)
+            return (t, name_token.lex, *dims)
+        elif t == Token.INT:
+            t = SymType.ARRAY_INT if dims else SymType.VAR_INT
+        else:
+            t = SymType.ARRAY_REAL if dims else SymType.VAR_REAL
         return (t, name_token.lex)
 
 
@@ -218,7 +315,27 @@ class Parser:
         self.must_be(Token.RPAREN, "Mismatched Parenthesis")
         body = self.parse_body()
 
-        return ParseNode(eval_while, [condition, body])
+        return hoist_bounds_checks(ParseNode(eval_while, [condition, body]))
+
+
+    def parse_parfor(self):
+        """
+        < Parfor >  ::= PARFOR ( IDENTIFIER , < Expr > , < Expr > ) < Body >
+        """
+
+        self.must_be(Token.PARFOR)
+        self.must_be(Token.LPAREN)
+        var_token = self.lexer.cur_tok
+        self.must_be(Token.IDENTIFIER)
+        self.must_be(Token.COMMA)
+        start = self.parse_expr()
+        self.must_be(Token.COMMA)
+        stop = self.parse_expr()
+        self.must_be(Token.RPAREN, "Mismatched Parenthesis")
+        body = self.parse_body()
+
+        return ParseNode(eval_parfor, [var_token.lex, start, stop, body],
+                         (var_token.line, var_token.col))
 
 
     def parse_if(self):
@@ -304,20 +421,321 @@ class Parser:
             self.next()
             return result
 
+        elif self.match(Token.STRING):
+            result = ParseNode(eval_string, [self.lexer.cur_tok.value])
+            self.next()
+            return result
+
         elif self.match(Token.IDENTIFIER):
             identifier = self.lexer.cur_tok.lex
+            pos = (self.lexer.cur_tok.line, self.lexer.cur_tok.col)
             self.next()
 
             # value'
             if self.have(Token.LPAREN):
-                return self.parse_call2(identifier)
-            return ParseNode(eval_identifier, [identifier])
+                return self.parse_call2(identifier, pos)
+            return self.parse_subscripts(ParseNode(eval_identifier, [identifier], pos))
+
+        elif self.match(Token.EOF):
+            # report the missing value without looping on EOF
+            self.must_be(Token.LPAREN)
+            return ParseNode(eval_number, [0])
 
         self.must_be(Token.LPAREN)
         result = self.parse_expr()
         self.must_be(Token.RPAREN, "Mismatched Parenthesis")
         return result
 
+class IterativeParser(Parser):
+    """
+    A parser for very large or deeply nested generated sources.
+
+    Expressions are parsed by an operator precedence loop over explicit
+    operand and operator stacks rather than by parse_expr -> parse_sum ->
+    parse_mul -> parse_value recursion, so parsing takes linear time and
+    constant Python stack however deeply expressions nest. It builds the
+    same tree as Parser.
+    """
+
+    def __init__(self, lexer):
+        super().__init__(lexer)
+
+        # binary operators and their precedence levels
+        self.operators = {
+            Token.LT: (1, eval_lt), Token.LTE: (1, eval_lte),
+            Token.GT: (1, eval_gt), Token.GTE: (1, eval_gte),
+            Token.EQUAL: (1, eval_equal),
+            Token.PLUS: (2, eval_plus), Token.MINUS: (2, eval_minus),
+            Token.TIMES: (3, eval_times), Token.DIV: (3, eval_divide)}
+
+
+    def parse_expr(self):
+        return self.parse_level(1)
+
+
+    def parse_sum(self):
+        return self.parse_level(2)
+
+
+    def parse_mul(self):
+        return self.parse_level(3)
+
+
+    def parse_value(self):
+        return self.parse_level(4)
+
+
+    def parse_level(self, level):
+        """
+        Parse an expression whose top-level operators have at least the
+        given precedence level: 1 comparisons, 2 sums, 3 products and 4 a
+        single value.
+
+        The stack holds pending binary operators as (level, eval) pairs and
+        open groups as lists: ['(', None],
+        ['call', name, first operand, position of the name],
+        ['[', base] for an index and ['[:', base, start] for a slice.
+        """
+
+        operands = []
+        stack = []
+        groups = 0
+
+        def reduce(min_level):
+            while stack and type(stack[-1]) == tuple and stack[-1][0] >= min_level:
+                op = stack.pop()
+                right = operands.pop()
+                left = operands.pop()
+                operands.append(ParseNode(op[1], [left, right]))
+
+        def close_group():
+            reduce(1)
+            group = stack.pop()
+            if group[0] == '(':
+                self.must_be(Token.RPAREN, "Mismatched Parenthesis")
+            elif group[0] == 'call':
+                args = operands[group[2]:]
+                del operands[group[2]:]
+                self.must_be(Token.RPAREN, "Mismatched Parenthesis")
+                operands.append(ParseNode(eval_call, [group[1], *args], group[3]))
+            elif group[0] == '[':
+                operands.append(ParseNode(eval_index, [group[1], operands.pop()]))
+                self.must_be(Token.RBRACKET, "Mismatched Brackets")
+            else:
+                stop = operands.pop() if len(group) == 4 else None
+                operands.append(ParseNode(eval_slice, [group[1], group[2], stop]))
+                self.must_be(Token.RBRACKET, "Mismatched Brackets")
+            return group[0] in ('[', '[:')
+
+        while True:
+            # operand
+            subscripts = False
+            if self.match((Token.INTNUM, Token.REALNUM)):
+                operands.append(ParseNode(eval_number, [self.lexer.cur_tok.value]))
+                self.next()
+            elif self.match(Token.STRING):
+                operands.append(ParseNode(eval_string, [self.lexer.cur_tok.value]))
+                self.next()
+            elif self.match(Token.IDENTIFIER):
+                identifier = self.lexer.cur_tok.lex
+                pos = (self.lexer.cur_tok.line, self.lexer.cur_tok.col)
+                self.next()
+                if self.have(Token.LPAREN):
+                    if self.have(Token.RPAREN):
+                        operands.append(ParseNode(eval_call, [identifier], pos))
+                    else:
+                        stack.append(['call', identifier, len(operands), pos])
+                        groups += 1
+                        continue
+                else:
+                    operands.append(ParseNode(eval_identifier, [identifier], pos))
+                    subscripts = True
+            elif self.match(Token.EOF):
+                # report the missing value without looping on EOF
+                self.must_be(Token.LPAREN)
+                operands.append(ParseNode(eval_number, [0]))
+            else:
+                # anything else must open a parenthesized expression
+                self.must_be(Token.LPAREN)
+                stack.append(['(', None])
+                groups += 1
+                continue
+
+            # subscripts, closing groups and operators
+            operand = False
+            while not operand:
+                if subscripts and self.have(Token.LBRACKET):
+                    base = operands.pop()
+                    if not self.have(Token.COLON):
+                        stack.append(['[', base])
+                        groups += 1
+                        operand = True
+                    elif self.match(Token.RBRACKET):
+                        operands.append(ParseNode(eval_slice, [base, None, None]))
+                        self.next()
+                    else:
+                        stack.append(['[:', base, None, True])
+                        groups += 1
+                        operand = True
+
+                elif self.lexer.cur_tok.token in self.operators:
+                    op = self.operators[self.lexer.cur_tok.token]
+                    if groups == 0 and op[0] < level:
+                        break
+                    reduce(op[0])
+                    stack.append(op)
+                    self.next()
+                    operand = True
+
+                elif groups == 0:
+                    break
+
+                else:
+                    # the innermost group decides what may follow
+                    reduce(1)
+                    group = stack[-1]
+                    if group[0] == 'call' and self.have(Token.COMMA):
+                        operand = True
+                    elif group[0] == '[' and self.have(Token.COLON):
+                        stack[-1] = ['[:', group[1], operands.pop()]
+                        if self.match(Token.RBRACKET):
+                            subscripts = close_group()
+                            groups -= 1
+                        else:
+                            stack[-1].append(True)
+                            operand = True
+                    else:
+                        subscripts = close_group()
+                        groups -= 1
+            else:
+                continue
+            break
+
+        reduce(1)
+        return operands.pop()
+
+
+# a begin or end word as the lexer would read it, or a string to skip over
+BLOCK_WORDS = re.compile(r'"[^"]*"?|(?<![^\W_])\d*(begin|BEGIN|end|END)(?![^\W_])')
+
+
+def split_functions(text):
+    """
+    Find the offset just past the end of each top-level function in text.
+    Returns None if the begin and end words in text do not balance.
+    """
+    ends = []
+    depth = 0
+    for match in BLOCK_WORDS.finditer(text):
+        word = match.group(1)
+        if word in ('begin', 'BEGIN'):
+            depth = depth + 1
+        elif word:
+            depth = depth - 1
+            if depth < 0:
+                return None
+            if depth == 0:
+                ends.append(match.end())
+    if depth != 0:
+        return None
+    return ends
+
+
+def parse_chunk(text, line, col, parser_class, lazy):
+    """
+    Parse the function-defs in a chunk of a program that starts at the
+    given line and column. Returns (function-defs, errors, output), where
+    output holds the error messages the parser printed.
+    """
+    parser = parser_class(Lexer(io.StringIO(text), line, col))
+    parser.lazy = lazy
+    defs = []
+    output = io.StringIO()
+    with redirect_stdout(output):
+        parser.next()
+        while not parser.match(Token.EOF):
+            defs.append(parser.parse_function_def())
+    return defs, parser.errors, output.getvalue()
+
+
+class ParallelParser:
+    """
+    A front end for multi-megabyte sources that parses a program's
+    function-defs on several cores.
+
+    The source is split after the end of top-level functions, found by a
+    scan of its begin and end words, into about four chunks per worker.
+    Each chunk is lexed and parsed in a process pool by parser_class,
+    starting from the line and column where the chunk begins so error
+    messages match a serial parse. The function-defs are then put back
+    together, in order, into the program block. Sources whose begin and
+    end words do not balance are parsed as one chunk.
+    """
+
+    def __init__(self, text, parser_class=Parser, workers=None):
+        self.text = text
+        self.parser_class = parser_class
+        self.workers = workers or os.cpu_count()
+        self.errors = 0
+        self.lazy = False
+
+
+    def chunks(self):
+        """
+        Return the (start, stop) offsets of the chunks to parse.
+        """
+        ends = split_functions(self.text)
+        if not ends:
+            return [(0, len(self.text))]
+
+        count = min(len(ends), self.workers * 4)
+        size = len(self.text) / count
+        spans = []
+        start = 0
+        for end in ends[:-1]:
+            if end - start >= size:
+                spans.append((start, end))
+                start = end
+        spans.append((start, len(self.text)))
+        return spans
+
+
+    def parse(self):
+        jobs = []
+        line = 1
+        prev = 0
+        for start, stop in self.chunks():
+            line = line + self.text.count('\n', prev, start)
+            col = start - (self.text.rfind('\n', 0, start) + 1)
+            jobs.append((self.text[start:stop], line, col, self.parser_class, self.lazy))
+            prev = start
+
+        if len(jobs) == 1 or self.workers == 1:
+            results = [parse_chunk(*job) for job in jobs]
+        else:
+            results = []
+            with ProcessPoolExecutor(self.workers) as pool:
+                futures = [pool.submit(parse_chunk, *job) for job in jobs]
+                for job, future in zip(jobs, futures):
+                    try:
+                        results.append(future.result())
+                    except RecursionError:
+                        # trees nested too deeply to pickle are parsed here
+                        results.append(parse_chunk(*job))
+
+        block = ParseNode(eval_block, [])
+        for defs, errors, output in results:
+            sys.stdout.write(output)
+            block.child.extend(defs)
+            self.errors = self.errors + errors
+        block.child.append(ParseNode(eval_call, ['main']))
+
+        if self.errors == 0:
+            return block
+        else:
+            return False
+
+
 if __name__ == '__main__':
     import sys
     file = open(sys.argv[1])
@@ -0,0 +1,119 @@
+"""
+Benchmark the recursive and iterative parsers on a generated program,
+the lazy parse that skips function bodies until they are called, and
+the parallel parse on an increasing number of cores.
+
+The program holds many small functions plus a few whose expressions nest
+very deeply, the shape our code generator emits.
+
+    python bench_parser.py --size 50 --depth 5000
+    python bench_parser.py --size 50 --cores 1,2,4,8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from Parser import Parser, IterativeParser, ParallelParser
+from lexer import Lexer
+
+
+def generate(file, size, depth):
+    """
+    Write a program of about size bytes to file. Every hundredth function
+    has an expression nested depth levels deep, every other one of them
+    inside the body of a counted while loop.
+    """
+    n = 0
+    while file.tell() < size:
+        file.write("int f%d(int a, int b)\nbegin\n    int x\n" % n)
+        if n % 100 == 0:
+            indent = "    "
+            if n % 200 == 100:
+                file.write("    int i\n    i := 1\n    while(i <= b)\n    begin\n")
+                indent = "        "
+            file.write(indent + "x := " + "(" * depth + "a")
+            for i in range(depth):
+                file.write("+%d)*b" % (i % 10))
+            file.write("\n")
+            if n % 200 == 100:
+                file.write("        a[i] := x\n        i := i + 1\n    end\n")
+        else:
+            file.write("    x := (a + b) * %d - a / (b + 1)\n" % n)
+        file.write("    while(x < b)\n        x := x + 1\n")
+        file.write("    print(x, a[1:n], f%d(x))\nend\n\n" % n)
+        n = n + 1
+    file.write("int main()\nbegin\n    f0(1, 2)\nend\n")
+    return n
+
+
+def bench(parser_class, path, lazy=False):
+    """
+    Parse the file and return (seconds, tree), tree is None on failure.
+    """
+    with open(path) as file:
+        parser = parser_class(Lexer(file))
+        parser.lazy = lazy
+        start = time.perf_counter()
+        try:
+            tree = parser.parse()
+        except RecursionError:
+            tree = None
+        return time.perf_counter() - start, tree
+
+
+def bench_parallel(path, workers):
+    """
+    Parse the file on workers cores and return (seconds, tree).
+    """
+    with open(path) as file:
+        parser = ParallelParser(file.read(), IterativeParser, workers)
+        start = time.perf_counter()
+        try:
+            tree = parser.parse()
+        except RecursionError:
+            tree = None
+        return time.perf_counter() - start, tree
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    arg_parser.add_argument('--size', type=float, default=50,
+                            help="program size in megabytes (default 50)")
+    arg_parser.add_argument('--depth', type=int, default=5000,
+                            help="nesting depth of the deep expressions (default 5000)")
+    arg_parser.add_argument('--cores', default=None,
+                            help="only time the parallel parser, on each of these "
+                                 "comma separated numbers of cores")
+    args = arg_parser.parse_args()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.fun', delete=False) as file:
+        functions = generate(file, int(args.size * 1024 * 1024), args.depth)
+    print("%d functions, %.1f MB, depth %d, recursion limit %d"%(functions,
+        os.path.getsize(file.name) / 1024 / 1024, args.depth, sys.getrecursionlimit()))
+
+    try:
+        if args.cores:
+            base = None
+            for workers in [int(n) for n in args.cores.split(',')]:
+                seconds, tree = bench_parallel(file.name, workers)
+                base = base or seconds
+                print("%2d cores %8.2f s  speedup %5.2f  %s"%(workers, seconds,
+                    base / seconds, "ok" if tree else "failed"))
+            sys.exit()
+
+        results = {}
+        for parser_class in (Parser, IterativeParser):
+            seconds, tree = bench(parser_class, file.name)
+            results[parser_class] = tree
+            status = "ok" if tree else "failed"
+            print("%-16s %8.2f s  %s"%(parser_class.__name__, seconds, status))
+
+        if results[Parser] and results[IterativeParser]:
+            print("trees equal:", results[Parser] == results[IterativeParser])
+
+        seconds, tree = bench(IterativeParser, file.name, lazy=True)
+        print("%-16s %8.2f s  %s"%("lazy", seconds, "ok" if tree else "failed"))
+    finally:
+        os.unlink(file.name)
@@ -0,0 +1,315 @@
+"""
+Checkpoint and resume of running programs.
+
+While checkpointing is on, the evaluator keeps a shadow stack of the
+blocks, loops, ifs and calls it is inside. At a while loop's back-edge
+that stack, the environments, and the input and output positions are
+written to a compressed pickle. Resuming parses the same program again
+and re-enters it along the saved stack, so execution continues from the
+loop iteration where the checkpoint was taken.
+
+Parse nodes are saved as their path from the root of the tree, and
+file-backed arrays as their file, so a checkpoint stays small and is
+rebuilt against the new parse.
+"""
+import io
+import os
+import pickle
+import sys
+import time
+import zlib
+from contextlib import contextmanager
+
+import Parser       # loads interpreter in the order its imports need
+import interpreter
+from interpreter import ParseNode, MappedArray
+
+
+class Preempted(Exception):
+    """
+    Raised once a checkpoint has been written after a SIGTERM.
+    """
+
+
+class CheckpointError(Exception):
+    """
+    Raised when a checkpoint does not match the program being resumed.
+    """
+
+
+class Pickler(pickle.Pickler):
+    """
+    Pickle parse nodes as paths and file-backed arrays as their files.
+    """
+    def __init__(self, file, paths):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.paths = paths
+
+
+    def persistent_id(self, obj):
+        if type(obj) == ParseNode and id(obj) in self.paths:
+            return ('node', self.paths[id(obj)])
+        elif type(obj) == MappedArray:
+            obj.flush()
+            return ('mapped', obj.path, obj.code)
+        return None
+
+
+class Unpickler(pickle.Unpickler):
+    """
+    Resolve the paths and files saved by Pickler.
+    """
+    def __init__(self, file, nodes):
+        super().__init__(file)
+        self.nodes = nodes
+
+
+    def persistent_load(self, pid):
+        if pid[0] == 'node':
+            if pid[1] not in self.nodes:
+                raise CheckpointError("checkpoint does not match the program")
+            return self.nodes[pid[1]]
+        return MappedArray(pid[1], pid[2])
+
+
+class Checkpointer:
+    """
+    Track the execution stack of a program and save or restore it.
+
+    The stack holds one list per frame:
+        ['block', node, index of the running statement]
+        ['while', node, True while in the body, body]
+        ['if', node]
+        ['call', node, function-def, local environment]
+        ['opaque'] for calls and parfors that cannot be re-entered
+
+    Calls can be re-entered only when they are a whole statement or the
+    whole right hand side of an assignment, since their arguments are
+    saved already evaluated. No checkpoint is taken while an opaque frame
+    is on the stack.
+    """
+    def __init__(self, tree : ParseNode, path=None, interval=None):
+        self.path = path
+        self.interval = interval
+        self.next_save = time.monotonic() + interval if interval else None
+        self.requested = False
+        self.frames = []
+        self.resume = []
+        self.opaque = 0
+
+        # number every node by its path from the root
+        self.paths = {}
+        self.nodes = {}
+        self.safe_calls = set()
+        self.index(tree, ())
+
+
+    def index(self, node : ParseNode, path):
+        if id(node) not in self.paths:
+            self.paths[id(node)] = path
+            self.nodes[path] = node
+
+        statements = []
+        if node.eval == interpreter.eval_block:
+            statements = node.child
+        elif node.eval in (interpreter.eval_while, interpreter.eval_if,
+                           interpreter.eval_counted_while):
+            statements = node.child[1:2]
+        elif node.eval in (interpreter.eval_assign, interpreter.eval_assign_unchecked):
+            statements = node.child[1:]
+        for statement in statements:
+            if type(statement) == ParseNode and statement.eval in (
+                    interpreter.eval_call, interpreter.eval_call_user):
+                self.safe_calls.add(id(statement))
+
+        for i, child in enumerate(node.child):
+            if type(child) == ParseNode:
+                self.index(child, path + (i,))
+
+
+    def on_sigterm(self, signum, frame):
+        self.requested = True
+
+
+    def save(self):
+        """
+        Write the current state to the checkpoint file.
+        """
+        sys.stdout.flush()
+        try:
+            output = os.lseek(sys.stdout.fileno(), 0, os.SEEK_CUR)
+        except (OSError, io.UnsupportedOperation):
+            output = None
+
+        state = {
+            'frames': self.frames,
+            'global_env': interpreter.global_env,
+            'input_lines': interpreter.input_lines,
+            'output': output,
+        }
+        buffer = io.BytesIO()
+        Pickler(buffer, self.paths).dump(state)
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as file:
+            file.write(zlib.compress(buffer.getvalue()))
+        os.replace(tmp, self.path)
+
+
+    def load(self, path):
+        """
+        Restore the state saved in a checkpoint file, ready for the program
+        to be run again from its root.
+        """
+        with open(path, 'rb') as file:
+            data = zlib.decompress(file.read())
+        state = Unpickler(io.BytesIO(data), self.nodes).load()
+
+        self.resume = state['frames']
+        interpreter.global_env = state['global_env']
+        self.charge_memory()
+
+        # skip the input the program had already read
+        for i in range(state['input_lines']):
+            sys.stdin.readline()
+        interpreter.input_lines = state['input_lines']
+
+        # drop output written after the checkpoint, it will be written again
+        output = state['output']
+        sys.stdout.flush()
+        try:
+            if output is not None and os.fstat(sys.stdout.fileno()).st_size >= output:
+                os.ftruncate(sys.stdout.fileno(), output)
+                os.lseek(sys.stdout.fileno(), output, os.SEEK_SET)
+        except (OSError, io.UnsupportedOperation):
+            pass
+
+
+    def charge_memory(self):
+        """
+        Charge the memory account for the restored environments and the
+        arrays, maps and matrices they hold, as the saved run had been.
+        """
+        memory = interpreter.memory
+        for env in [interpreter.global_env] + [f[3] for f in self.resume
+                                               if f[0] == 'call']:
+            nbytes = env.bytes
+            if env is interpreter.global_env:
+                # as in a fresh run, the frame and builtins are not charged
+                builtins = [entry for entry in env.env.maps[0].values()
+                            if entry.sym_type in (interpreter.SymType.BUILTIN_INT,
+                                                  interpreter.SymType.BUILTIN_REAL)]
+                nbytes -= interpreter.FRAME_BYTES + interpreter.ENTRY_BYTES * len(builtins)
+            memory.charge(nbytes)
+            for entry in env.env.maps[0].values():
+                memory.track(entry.sym_value)
+
+
+    def take(self, kind : str, node : ParseNode):
+        """
+        Take the next saved frame while resuming, which must be for node.
+        """
+        frame = self.resume.pop(0)
+        if frame[0] != kind or frame[1] is not node:
+            raise CheckpointError("checkpoint does not match the program")
+        return frame
+
+
+    def safe_point(self):
+        """
+        Save a checkpoint here if one is due and the stack can be re-entered.
+        """
+        if self.opaque:
+            return
+        if self.requested:
+            self.save()
+            raise Preempted()
+        if self.next_save is not None and time.monotonic() >= self.next_save:
+            self.save()
+            self.next_save = time.monotonic() + self.interval
+
+
+    @contextmanager
+    def opaque_region(self):
+        """
+        Run code that cannot be re-entered, with checkpoints held off.
+        """
+        self.frames.append(['opaque'])
+        self.opaque += 1
+        try:
+            yield
+        finally:
+            self.opaque -= 1
+            self.frames.pop()
+
+
+    def run_block(self, node : ParseNode, env):
+        start = 0
+        if self.resume:
+            start = self.take('block', node)[2]
+
+        frame = ['block', node, start]
+        self.frames.append(frame)
+        try:
+            for i in range(start, len(node.child)):
+                frame[2] = i
+                statement = node.child[i]
+                statement.eval(statement, env)
+        finally:
+            self.frames.pop()
+
+
+    def run_while(self, node : ParseNode, body : ParseNode, env):
+        in_body = False
+        if self.resume:
+            saved = self.take('while', node)
+            in_body = saved[2]
+            body = saved[3]
+
+        frame = ['while', node, in_body, body]
+        self.frames.append(frame)
+        try:
+            while True:
+                if in_body:
+                    body.eval(body, env)
+                    frame[2] = in_body = False
+                    self.safe_point()
+                if not node.child[0].eval(node.child[0], env):
+                    break
+                frame[2] = in_body = True
+        finally:
+            self.frames.pop()
+
+
+    def run_if(self, node : ParseNode, env):
+        if self.resume:
+            self.take('if', node)
+        elif not node.child[0].eval(node.child[0], env):
+            return
+
+        self.frames.append(['if', node])
+        try:
+            node.child[1].eval(node.child[1], env)
+        finally:
+            self.frames.pop()
+
+
+    def run_call(self, node : ParseNode, f : ParseNode, env):
+        if id(node) not in self.safe_calls:
+            with self.opaque_region():
+                return f.child[3].eval(f.child[3], env)
+
+        self.frames.append(['call', node, f, env])
+        try:
+            return f.child[3].eval(f.child[3], env)
+        finally:
+            self.frames.pop()
+
+
+    def resume_call(self, node : ParseNode):
+        saved = self.take('call', node)
+        try:
+            return self.run_call(node, saved[2], saved[3])
+        finally:
+            # the frame was charged when the checkpoint was loaded
+            saved[3].release()
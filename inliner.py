@@ -0,0 +1,275 @@
+"""
+Inlining of small user functions at their call sites.
+
+A call that is a whole statement is replaced by the body of the function
+it calls, so the call no longer pays for the lookup, the argument list,
+the new Environment and the parameter binding. The function's parameters
+and locals are renamed to names the lexer cannot produce, of the form
+function.name.site, so they never clash with the caller's variables, and
+each parameter is declared and assigned its argument in order, as
+eval_call binds them.
+
+Functions are inlined bottom-up through the call graph, so a caller that
+is small enough after its own callees are inlined is inlined in turn.
+Recursive functions are never inlined, and the whole pass stops once the
+tree has grown by its budget.
+"""
+import Parser       # loads interpreter in the order its imports need
+import interpreter
+from interpreter import ParseNode
+
+# largest function body, in parse nodes, that is inlined
+INLINE_SIZE = 40
+
+# growth allowed, as a fraction of the size of the program's tree
+INLINE_BUDGET = 1.0
+
+
+def size(node : ParseNode):
+    """
+    Number of parse nodes in the tree below node.
+    """
+    return sum(1 for n in interpreter.parse_nodes(node))
+
+
+def declared(fun_def : ParseNode):
+    """
+    Names a function defines in its own environment: parameters, locals
+    and parfor variables.
+    """
+    names = {n for t, n, *dims in fun_def.child[2]}
+    for n in interpreter.parse_nodes(fun_def.child[3]):
+        if n.eval == interpreter.eval_decl:
+            names.add(n.child[1])
+        elif n.eval == interpreter.eval_parfor:
+            names.add(n.child[0])
+    return names
+
+
+def used(node : ParseNode):
+    """
+    Return (names, calls): the variable names used below node and the
+    names of the functions it calls.
+    """
+    names = set()
+    calls = set()
+    for n in interpreter.parse_nodes(node):
+        if n.eval in (interpreter.eval_identifier, interpreter.eval_assign,
+                      interpreter.eval_parfor):
+            names.add(n.child[0])
+        elif n.eval == interpreter.eval_decl:
+            names.add(n.child[1])
+        elif n.eval == interpreter.eval_call:
+            calls.add(n.child[0])
+    return names, calls
+
+
+def rename(node : ParseNode, names : dict):
+    """
+    Copy the tree below node with the variables in names renamed.
+    """
+    child = [rename(c, names) if isinstance(c, ParseNode) else c for c in node.child]
+    if node.eval in (interpreter.eval_identifier, interpreter.eval_assign,
+                     interpreter.eval_parfor):
+        child[0] = names.get(child[0], child[0])
+    elif node.eval == interpreter.eval_decl:
+        child[1] = names.get(child[1], child[1])
+    elif node.eval == interpreter.eval_counted_while:
+        child[3] = names.get(child[3], child[3])
+        child[5] = [names.get(a, a) for a in child[5]]
+    return node._replace(child=child)
+
+
+class Inliner:
+    """
+    Inline the small, non-recursive functions of a program.
+
+    report holds one line per call site looked at, saying whether it was
+    inlined and, if not, why.
+    """
+    def __init__(self, tree : ParseNode, limit=INLINE_SIZE, budget=INLINE_BUDGET):
+        self.tree = tree
+        self.limit = limit
+        self.original = size(tree)
+        self.budget = int(self.original * budget)
+        self.sites = 0
+        self.inlined = 0
+        self.report = []
+
+        # the last definition of a name is the one that gets called
+        self.functions = {}
+        for n in tree.child:
+            if n.eval == interpreter.eval_function_def:
+                self.functions[n.child[1]] = n
+
+
+    def callees(self, fun_def : ParseNode):
+        """
+        Names of the user functions fun_def calls.
+        """
+        names, calls = used(fun_def.child[3])
+        return {c for c in calls - declared(fun_def) if c in self.functions}
+
+
+    def order(self):
+        """
+        Return (order, recursive): the functions with every callee before
+        its callers, and the names of the functions that can reach
+        themselves through calls.
+        """
+        graph = {name : self.callees(f) for name, f in self.functions.items()}
+
+        recursive = set()
+        for name in graph:
+            seen = set()
+            stack = list(graph[name])
+            while stack:
+                callee = stack.pop()
+                if callee == name:
+                    recursive.add(name)
+                    break
+                if callee not in seen:
+                    seen.add(callee)
+                    stack.extend(graph[callee])
+
+        order = []
+        visited = set()
+        for name in graph:
+            if name in visited:
+                continue
+            visited.add(name)
+            stack = [(name, iter(graph[name]))]
+            while stack:
+                callee = next(stack[-1][1], None)
+                if callee is None:
+                    order.append(stack.pop()[0])
+                elif callee not in visited:
+                    visited.add(callee)
+                    stack.append((callee, iter(graph[callee])))
+        return order, recursive
+
+
+    def run(self):
+        """
+        Inline calls throughout the program. Returns the report.
+        """
+        order, self.recursive = self.order()
+        for name in order:
+            caller = self.functions[name]
+            self.caller = caller
+            self.locals = declared(caller)
+            self.inline_statements(caller.child[3])
+
+        self.report.append("inlined %d of %d call sites, %d nodes grew to %d"%(
+            self.inlined, self.sites, self.original, size(self.tree)))
+        return self.report
+
+
+    def inline_statements(self, node : ParseNode):
+        """
+        Inline the calls in statement position below node.
+        """
+        if node.eval == interpreter.eval_block:
+            i = 0
+            while i < len(node.child):
+                statements = self.expand(node.child[i])
+                if statements is None:
+                    self.inline_statements(node.child[i])
+                    i = i + 1
+                else:
+                    node.child[i:i + 1] = statements
+                    i = i + len(statements)
+            return
+
+        if node.eval in (interpreter.eval_while, interpreter.eval_if,
+                         interpreter.eval_counted_while):
+            bodies = [1]
+        elif node.eval == interpreter.eval_parfor:
+            bodies = [3]
+        else:
+            return
+        for i in bodies:
+            statements = self.expand(node.child[i])
+            if statements is None:
+                self.inline_statements(node.child[i])
+            else:
+                node.child[i] = ParseNode(interpreter.eval_block, statements)
+
+
+    def expand(self, node : ParseNode):
+        """
+        The statements replacing a call, or None if node is not a call
+        that can be inlined.
+        """
+        if node.eval != interpreter.eval_call or node.child[0] not in self.functions:
+            return None
+
+        name = node.child[0]
+        where = "%s in %s"%(name, self.caller.child[1])
+        self.sites = self.sites + 1
+        reason = self.check(node)
+        if reason:
+            self.report.append("kept %s: %s"%(where, reason))
+            return None
+
+        f = self.functions[name]
+        names = {n : "%s.%s.%d"%(name, n, self.sites) for n in declared(f)}
+        statements = []
+        for (t, n, *dims), arg in zip(f.child[2], node.child[1:]):
+            statements.append(ParseNode(interpreter.eval_decl, [t, names[n]], node.pos))
+            statements.append(ParseNode(interpreter.eval_assign, [names[n], arg], node.pos))
+        statements.extend(rename(s, names) for s in f.child[3].child)
+
+        growth = sum(size(s) for s in statements) - size(node)
+        if growth > self.budget:
+            self.report.append("kept %s: over the growth budget"%(where))
+            return None
+        self.budget = self.budget - growth
+        self.inlined = self.inlined + 1
+        self.report.append("inlined %s (%d nodes)"%(where, growth))
+        return statements
+
+
+    def check(self, node : ParseNode):
+        """
+        Reason the call node cannot be inlined, None if it can.
+        """
+        name = node.child[0]
+        f = self.functions[name]
+        if name in self.recursive:
+            return "recursive"
+        if name in self.locals:
+            return "%s is a variable in the caller"%(name)
+        if len(node.child) - 1 != len(f.child[2]):
+            return "wrong number of arguments"
+
+        body = size(f.child[3])
+        if body > self.limit:
+            return "%d nodes is over the size limit"%(body)
+
+        local = declared(f)
+        names, calls = used(f.child[3])
+        if local & calls:
+            return "a local shadows a function"
+        if local & set(interpreter.SPECIAL_NAMES):
+            return "a local is named like a special assignment"
+        for n in interpreter.parse_nodes(f.child[3]):
+            if n.eval == interpreter.eval_assign and n.child[0] in local and \
+                    n.child[1].child and n.child[1].child[0] == 'read':
+                # the prompt names the variable, which inlining renames
+                return "reads into %s"%(n.child[0])
+        for arg in node.child[1:]:
+            if arg.child and arg.child[0] in interpreter.SPECIAL_NAMES:
+                return "argument %s"%(arg.child[0])
+        captured = ((names | calls) - local) & self.locals
+        if captured:
+            return "would capture %s"%(", ".join(sorted(captured)))
+        return None
+
+
+def inline_program(tree : ParseNode, limit=INLINE_SIZE, budget=INLINE_BUDGET):
+    """
+    Inline the small functions of a parsed program in place.
+    Returns the inlining report, one line per call site and a summary.
+    """
+    return Inliner(tree, limit, budget).run()
@@ -2,7 +2,19 @@
 Collection of functions and objects needed to interpret programs.
 """
 from collections import ChainMap, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum,auto
+import atexit
+import io
+import logging
+import mmap
+import operator
+import os
+import weakref
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from Parser import *
 from lexer import *
 
@@ -13,6 +25,11 @@ class SymType(Enum):
     BUILTIN_REAL = auto()
     VAR_INT = auto()
     VAR_REAL = auto()
+    ARRAY_INT = auto()
+    ARRAY_REAL = auto()
+    MATRIX_INT = auto()
+    MATRIX_REAL = auto()
+    VAR_MAP = auto()
 
 
 class SymbolTableEntry:
@@ -24,6 +41,117 @@ class SymbolTableEntry:
         self.sym_value = sym_value
 
 
+# approximate sizes charged to a program's memory account
+FRAME_BYTES = 400       # an Environment, its ChainMap and local dict
+ENTRY_BYTES = 120       # a SymbolTableEntry and its slot in the dict
+ARRAY_BYTES = 56        # an empty array
+ELEMENT_BYTES = 40      # an array slot and the number in it
+MAP_BYTES = 64          # an empty map
+PAIR_BYTES = 100        # a map slot and the key and value in it
+
+
+class MemoryLimitError(Exception):
+    """
+    Raised when a program grows past its memory cap.
+    """
+
+
+class LazyParseError(Exception):
+    """
+    Raised when a function body skipped by a lazy parse has syntax errors
+    on its first call.
+    """
+
+
+class MemoryAccount:
+    """
+    Approximate bytes held by a program's environments and arrays.
+
+    Frames are charged when they are created and released when their call
+    returns. Arrays, maps and matrices are charged when a variable first
+    holds them and as they grow, and released when they are garbage
+    collected.
+    """
+    def __init__(self, cap=None):
+        self.cap = cap
+        self.used = 0
+        self.peak = 0
+        self.sizes = {}
+
+
+    def charge(self, nbytes:int):
+        """
+        Charge nbytes, raising MemoryLimitError if that passes the cap.
+        """
+        self.used += nbytes
+        if self.used > self.peak:
+            self.peak = self.used
+            if self.cap is not None and self.used > self.cap:
+                raise MemoryLimitError("memory limit of %d bytes exceeded"%(self.cap))
+
+
+    def release(self, nbytes:int):
+        self.used -= nbytes
+
+
+    def reset(self):
+        """
+        Start counting from zero, leaving out what the interpreter itself
+        has been charged for.
+        """
+        self.used = 0
+        self.peak = 0
+
+
+    def track(self, value):
+        """
+        Start charging for an array, map or matrix, unless it already is.
+        """
+        if type(value) == Array:
+            nbytes = ARRAY_BYTES + ELEMENT_BYTES * len(value)
+        elif type(value) == Map:
+            nbytes = MAP_BYTES + PAIR_BYTES * len(value)
+        elif numpy and type(value) == numpy.ndarray and value.base is None:
+            nbytes = ARRAY_BYTES + value.nbytes
+        else:
+            return
+        if id(value) in self.sizes:
+            return
+        self.sizes[id(value)] = nbytes
+        weakref.finalize(value, self.forget, id(value))
+        self.charge(nbytes)
+
+
+    def grow(self, value, nbytes:int):
+        """
+        Charge a tracked array or map for nbytes more, or release it
+        if nbytes is negative.
+        """
+        if id(value) in self.sizes:
+            self.sizes[id(value)] += nbytes
+            self.charge(nbytes)
+
+
+    def forget(self, key:int):
+        self.release(self.sizes.pop(key))
+
+
+# the running program's memory account
+memory = MemoryAccount()
+
+
+class Array(list):
+    """
+    A program's array, a list that the memory account can track.
+    """
+
+
+class Map(dict):
+    """
+    A program's map, a dict that the memory account can track.
+    """
+
+
 class Environment:
     """
     A nested environment for storing program variables.
@@ -33,6 +161,8 @@ class Environment:
             self.env = ChainMap({})
         else:
             self.env = ChainMap({}, parent.env)
+        self.bytes = FRAME_BYTES
+        memory.charge(FRAME_BYTES)
 
 
     def lookup(self, key:str):
@@ -51,7 +181,171 @@ class Environment:
         """
         Insert an entry into the current environment.
         """
+        if name not in self.env.maps[0]:
+            self.bytes += ENTRY_BYTES
+            memory.charge(ENTRY_BYTES)
         self.env[name] = entry
+        memory.track(entry.sym_value)
+
+
+    def release(self):
+        """
+        Release the memory charged for this environment's frame.
+        """
+        memory.release(self.bytes)
+        self.bytes = 0
+
+
+class MappedArray:
+    """
+    An array whose elements live in a binary file mapped into memory.
+    Elements are native 8 byte integers ('q') or doubles ('d'), read and
+    written straight through the mapping. Values stored are converted to
+    the element type, so reals stored in an integer array are truncated.
+    """
+    def __init__(self, path:str, code:str, length=None):
+        self.path = path
+        self.code = code
+        self.convert = int if code == 'q' else float
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+
+        # grow the file to hold the requested number of elements
+        itemsize = memoryview(b'').cast(code).itemsize
+        size = os.fstat(self.file.fileno()).st_size
+        if length is not None and length * itemsize > size:
+            self.file.truncate(length * itemsize)
+            size = length * itemsize
+        size = size - size % itemsize
+
+        if size == 0:
+            self.map = None
+            self.view = memoryview(b'').cast(code)
+        else:
+            self.map = mmap.mmap(self.file.fileno(), size)
+            self.view = memoryview(self.map).cast(code)
+        mapped_arrays.append(self)
+
+
+    def __len__(self):
+        return len(self.view)
+
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.view[i].tolist()
+        return self.view[i]
+
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            for j, v in zip(range(*i.indices(len(self.view))), value):
+                self.store(j, v)
+        else:
+            self.store(i, value)
+
+
+    def store(self, i:int, value):
+        """
+        Store a value in element i, converted to the element type.
+        """
+        try:
+            self.view[i] = self.convert(value)
+        except (TypeError, ValueError):
+            print("Error: cannot store %s in %s"%(value, self.path))
+
+
+    def __iter__(self):
+        return iter(self.view)
+
+
+    def __reduce__(self):
+        # worker processes map the same file rather than copy the elements
+        self.flush()
+        return (MappedArray, (self.path, self.code))
+
+
+    def flush(self):
+        """
+        Write modified elements back to the file.
+        """
+        if self.map is not None:
+            self.map.flush()
+
+
+    def close(self):
+        """
+        Flush and release the mapping.
+        """
+        self.flush()
+        self.view.release()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+
+class ArrayView:
+    """
+    A window onto part of another array. Elements are read and written in
+    the underlying array, so taking a slice never copies.
+    """
+    def __init__(self, base, start:int, stop:int):
+        self.base = base
+        self.start = start
+        self.stop = stop
+
+
+    def __len__(self):
+        return self.stop - self.start
+
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                # a strided slice is copied, a view only covers a contiguous run
+                return [self.base[self.start + j] for j in range(start, stop, step)]
+            return ArrayView(self.base, self.start + start, self.start + max(start, stop))
+        return self.base[self.start + i]
+
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            for j, v in zip(range(*i.indices(len(self))), value):
+                self.base[self.start + j] = v
+        else:
+            self.base[self.start + i] = value
+
+
+    def __iter__(self):
+        for i in range(self.start, self.stop):
+            yield self.base[i]
+
+
+# every file-backed array still open, flushed when the interpreter exits
+mapped_arrays = []
+
+
+@atexit.register
+def close_mapped_arrays():
+    """
+    Flush and close every file-backed array.
+    """
+    while mapped_arrays:
+        mapped_arrays.pop().close()
+
+
+# lines of input the program has read, kept for checkpoints
+input_lines = 0
+
+
+def read_line(prompt=''):
+    """
+    Read a line of program input.
+    """
+    global input_lines
+    line = input(prompt)
+    input_lines += 1
+    return line
 
 
 # builtin functions
@@ -59,7 +353,14 @@ def builtin_print(args, env):
     """
     Print arguments, return 0.
     """
-    if len(args)==1 and type(args[0])==type([]):
+    if len(args)==1 and numpy and isinstance(args[0], numpy.ndarray) and args[0].ndim == 2:
+        for row in args[0]:
+            print(*row)
+    elif len(args)==1 and type(args[0]) == Map:
+        for key, value in args[0].items():
+            print(key, value)
+    elif len(args)==1 and isinstance(args[0], (list, MappedArray, ArrayView)
+                                     + ((numpy.ndarray,) if numpy else ())):
             for i in args[0]:
                 print(i)
     else:
@@ -71,14 +372,134 @@ def builtin_readint(args, env):
     """
     Read an integer and return it.
     """
-    return int(input())
+    return int(read_line())
 
 
 def builtin_readreal(args, env):
     """
     Read a real and return it.
     """
-    return float(input())
+    return float(read_line())
+
+
+def builtin_fileint(args, env):
+    """
+    Map a file of integers as an array and return it.
+    An optional second argument grows the file to that many elements.
+    """
+    return MappedArray(args[0], 'q', *args[1:2])
+
+
+def builtin_filereal(args, env):
+    """
+    Map a file of reals as an array and return it.
+    An optional second argument grows the file to that many elements.
+    """
+    return MappedArray(args[0], 'd', *args[1:2])
+
+
+# matrix builtins, each a single vectorized numpy call
+def builtin_matmul(args, env):
+    """
+    Return the matrix product of two matrices.
+    """
+    return numpy.matmul(args[0], args[1])
+
+
+def builtin_transpose(args, env):
+    """
+    Return the transpose of a matrix.
+    """
+    return numpy.ascontiguousarray(numpy.transpose(args[0]))
+
+
+def builtin_elemadd(args, env):
+    """
+    Return the element-wise sum of two matrices.
+    """
+    return numpy.add(args[0], args[1])
+
+
+def builtin_elemmul(args, env):
+    """
+    Return the element-wise product of two matrices.
+    """
+    return numpy.multiply(args[0], args[1])
+
+
+def builtin_rowsum(args, env):
+    """
+    Return an array holding the sum of each row of a matrix.
+    """
+    return numpy.sum(args[0], axis=1)
+
+
+def builtin_colsum(args, env):
+    """
+    Return an array holding the sum of each column of a matrix.
+    """
+    return numpy.sum(args[0], axis=0)
+
+
+def builtin_fill(args, env):
+    """
+    Set every element of a matrix to a value, return 0.
+    """
+    args[0].fill(args[1])
+    return 0
+
+
+# map builtins
+def builtin_mapget(args, env):
+    """
+    Return the value stored under a key in a map.
+    """
+    if args[1] not in args[0]:
+        print("Error: key %s not in map"%(args[1]))
+        return 0
+    return args[0][args[1]]
+
+
+def builtin_mapput(args, env):
+    """
+    Store a value under a key in a map, return 0.
+    """
+    if args[1] not in args[0]:
+        memory.grow(args[0], PAIR_BYTES)
+    args[0][args[1]] = args[2]
+    return 0
+
+
+def builtin_mapcontains(args, env):
+    """
+    Return 1 if a map holds a key, 0 if not.
+    """
+    return 1 if args[1] in args[0] else 0
+
+
+def builtin_mapdelete(args, env):
+    """
+    Remove a key from a map. Returns 1 if it was there, 0 if not.
+    """
+    if args[1] not in args[0]:
+        return 0
+    del args[0][args[1]]
+    memory.grow(args[0], -PAIR_BYTES)
+    return 1
+
+
+def builtin_mapsize(args, env):
+    """
+    Return the number of keys in a map.
+    """
+    return len(args[0])
+
+
+def builtin_mapkeys(args, env):
+    """
+    Return an array of the keys of a map, in the order they were first put.
+    """
+    return Array(args[0].keys())
 
 
 # build the global environment
@@ -86,9 +507,106 @@ global_env = Environment()
 global_env.define('print', SymbolTableEntry(SymType.BUILTIN_INT, builtin_print))
 global_env.define('read', SymbolTableEntry(SymType.BUILTIN_INT, builtin_readint))
 global_env.define('readreal', SymbolTableEntry(SymType.BUILTIN_REAL, builtin_readreal))
+global_env.define('fileint', SymbolTableEntry(SymType.BUILTIN_INT, builtin_fileint))
+global_env.define('filereal', SymbolTableEntry(SymType.BUILTIN_REAL, builtin_filereal))
+global_env.define('matmul', SymbolTableEntry(SymType.BUILTIN_REAL, builtin_matmul))
+global_env.define('transpose', SymbolTableEntry(SymType.BUILTIN_REAL, builtin_transpose))
+global_env.define('elemadd', SymbolTableEntry(SymType.BUILTIN_REAL, builtin_elemadd))
+global_env.define('elemmul', SymbolTableEntry(SymType.BUILTIN_REAL, builtin_elemmul))
+global_env.define('rowsum', SymbolTableEntry(SymType.BUILTIN_REAL, builtin_rowsum))
+global_env.define('colsum', SymbolTableEntry(SymType.BUILTIN_REAL, builtin_colsum))
+global_env.define('fill', SymbolTableEntry(SymType.BUILTIN_INT, builtin_fill))
+global_env.define('mapget', SymbolTableEntry(SymType.BUILTIN_REAL, builtin_mapget))
+global_env.define('mapput', SymbolTableEntry(SymType.BUILTIN_INT, builtin_mapput))
+global_env.define('mapcontains', SymbolTableEntry(SymType.BUILTIN_INT, builtin_mapcontains))
+global_env.define('mapdelete', SymbolTableEntry(SymType.BUILTIN_INT, builtin_mapdelete))
+global_env.define('mapsize', SymbolTableEntry(SymType.BUILTIN_INT, builtin_mapsize))
+global_env.define('mapkeys', SymbolTableEntry(SymType.BUILTIN_INT, builtin_mapkeys))
+
+# define a parse node as a named tuple, pos is the (line, column) of the
+# names, statements and function-defs the parser creates
+ParseNode = namedtuple("ParseNode", ("eval", "child", "pos"), defaults=(None,))
+
+# names eval_assign handles specially when they appear on the right
+SPECIAL_NAMES = ('read', 'insert', 'rev', 'bublesort')
+
+# parallel loops with fewer iterations than this run in-process
+PARFOR_MIN_ITERATIONS = 1000
+
+# number of worker processes for parallel loops, None uses every core
+PARFOR_WORKERS = None
+
+# calls to a function and iterations of a while loop after which they are
+# compiled to closures, None leaves them interpreted
+TIER_CALL_THRESHOLD = 50
+TIER_LOOP_THRESHOLD = 1000
+
+# tiering state, keyed by the id of the function-def or while node
+call_counts = {}
+loop_counts = {}
+compiled = {}
+
+logger = logging.getLogger("interpreter")
+
+# the checkpoint.Checkpointer tracking execution, None when not checkpointing
+checkpointer = None
+
+
+def parse_nodes(node : ParseNode):
+    """
+    Yield the node and every parse node below it, each before its children.
+    The walk keeps its own stack, so it handles trees of any depth.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(child for child in reversed(node.child)
+                     if isinstance(child, ParseNode))
 
-# define a parse node as a named tuple
-ParseNode = namedtuple("ParseNode", ("eval", "child"))
+
+def check_bounds(array, i, node : ParseNode):
+    """
+    Check that the 1-based index i is inside array.
+    Prints an error and returns False if it is not.
+    """
+    if not hasattr(array, '__len__'):
+        print("Error: %s is not an array"%(node_name(node)))
+        return False
+    if i < 1 or i > len(array):
+        print("Error: %s[%d] out of bounds"%(node_name(node), i))
+        return False
+    return True
+
+
+def node_name(node : ParseNode):
+    """
+    Name of the variable an identifier, index or slice node refers to.
+    """
+    while node.eval not in (eval_identifier, eval_identifier_unchecked):
+        node = node.child[0]
+    return node.child[0]
+
+
+def element_ref(node : ParseNode, env : Environment):
+    """
+    Resolve an index node to the array and 0-based offset it refers to.
+    Returns (None, None) after printing an error if the element does not exist.
+    """
+    base = node.child[0]
+    if base.eval in (eval_index, eval_index_counted):
+        # a row of a matrix, which must exist itself
+        array, offset = element_ref(base, env)
+        if array is None:
+            return None, None
+        array = array[offset]
+    else:
+        array = base.eval(base, env)
+    i = node.child[1].eval(node.child[1], env)
+    if not (node.eval == eval_index_counted and node.child[2][0]) and \
+            not check_bounds(array, i, node):
+        return None, None
+    return array, i - 1
 
 
 # Semantic elements of the language
@@ -102,6 +620,349 @@ def eval_function_def(node : ParseNode, env : Environment):
     child[3] - Block
     """
     env.define(node.child[1], SymbolTableEntry(node.child[0], node))
+    call_counts[id(node)] = 0
+    compiled.pop(id(node), None)
+
+
+def eval_lazy_body(node : ParseNode, env : Environment):
+    """
+    Evaluate a function body skipped by a lazy parse. eval_call replaces
+    these with their parse before the first call, see parse_body.
+
+    child[0] - Source text of the block
+    child[1] - Line of its begin
+    child[2] - Column of its begin
+    child[3] - Parser class
+    """
+    block, errors = lazy_parse(node)
+    if errors:
+        raise LazyParseError("function body failed to parse with %d errors"%(errors))
+    return block.eval(block, env)
+
+
+def lazy_parse(node : ParseNode):
+    """
+    Parse the block held by a lazy body node.
+    Returns (block, errors), the block is None if there were errors.
+    """
+    text, line, col, parser_class = node.child
+    parser = parser_class(Lexer(io.StringIO(text), line, col - 1))
+    parser.next()
+    block = parser.parse_block()
+    if parser.errors:
+        return None, parser.errors
+    return block, 0
+
+
+def parse_body(f : ParseNode):
+    """
+    Parse the body of a function-def in place if it was skipped.
+    Returns the number of syntax errors in it, a body with errors is
+    left unparsed.
+    """
+    if f.child[3].eval != eval_lazy_body:
+        return 0
+    block, errors = lazy_parse(f.child[3])
+    if errors == 0:
+        f.child[3] = block
+    return errors
+
+
+def parse_bodies(tree : ParseNode):
+    """
+    Parse every function body a lazy parse skipped.
+    Returns the number of syntax errors in them.
+    """
+    return sum(parse_body(f) for f in tree.child if f.eval == eval_function_def)
+
+
+def base_name(node : ParseNode):
+    """
+    Name of the variable an identifier, index or slice node refers to,
+    None for any other expression.
+    """
+    while node.eval in (eval_index, eval_index_counted, eval_slice):
+        node = node.child[0]
+    if node.eval in (eval_identifier, eval_identifier_unchecked):
+        return node.child[0]
+    return None
+
+
+def user_function(name : str, env : Environment):
+    """
+    The function-def a call to name runs, None if name is not a user function.
+    """
+    entry = env.lookup(name)
+    if entry and entry.sym_type in (SymType.FUN_INT, SymType.FUN_REAL):
+        return entry.sym_value
+    return None
+
+
+def call_writes(f : ParseNode, env : Environment, active=()):
+    """
+    Find the arguments a call to the user function f may change.
+
+    Arrays, matrices and maps are passed by reference, so the callee writes
+    its caller's value when it stores into, swaps, inserts into, fills or
+    puts into a parameter, or passes the parameter on to a function that
+    does. Returns (error, written) where error says why f cannot run in a
+    parfor at all and written holds the indices of the parameters it may
+    write, any of their elements.
+    """
+    if f.child[3].eval == eval_lazy_body and parse_body(f):
+        return "failed to parse", set()
+
+    params = [n for t, n, *dims in f.child[2]]
+    if f.child[1] in active:
+        # a recursive call may write anything it is passed
+        return None, set(range(len(params)))
+    active = active + (f.child[1],)
+
+    changed = set()
+    for n in parse_nodes(f.child[3]):
+        targets = []
+        if n.eval == eval_parfor:
+            return "contains a parfor", set()
+        elif n.eval in (eval_assign, eval_assign_unchecked):
+            if n.child[1].child[0] in ('read', 'insert'):
+                return "reads input through %s"%(n.child[1].child[0]), set()
+        elif n.eval == eval_store:
+            targets = [n.child[0]]
+        elif n.eval == eval_swap:
+            targets = [t for t in n.child if t.eval not in (eval_identifier,
+                                                            eval_identifier_unchecked)]
+        elif n.eval in (eval_call, eval_call_user, eval_call_builtin):
+            name = n.child[0]
+            args = n.child[1:]
+            if name in ('print', 'read', 'readreal'):
+                return "performs I/O through %s"%(name), set()
+            elif name in ('fill', 'mapput', 'mapdelete') and args:
+                targets = [args[0]]
+            elif name not in params and user_function(name, env):
+                error, written = call_writes(user_function(name, env), env, active)
+                if error:
+                    return "calls %s, which %s"%(name, error), set()
+                targets = [args[i] for i in written if i < len(args)]
+        changed.update(base_name(t) for t in targets)
+    return None, {i for i in range(len(params)) if params[i] in changed}
+
+
+def parfor_dependencies(var : str, body : ParseNode, env : Environment):
+    """
+    Check that the iterations of a parfor body are independent.
+
+    An iteration may only write scalars declared in the body and elements
+    indexed by the loop variable, and may only read the array elements it
+    writes itself. Calls to user functions may only change arrays declared
+    in the body. Changes to maps are left to shared_map_writes. Returns
+    (error, written) where error is None for a valid body and written lists
+    the arrays the body stores into.
+    """
+    local = {var}
+    element = {}
+    for n in parse_nodes(body):
+        if n.eval == eval_decl:
+            local.add(n.child[1])
+        elif n.eval in (eval_index, eval_index_counted, eval_slice) and \
+                n.child[0].eval == eval_identifier:
+            element[id(n.child[0])] = n
+
+    def own_element(n):
+        # a[var], the element only this iteration touches
+        return (n.eval == eval_index and n.child[0].eval == eval_identifier
+                and n.child[1].eval == eval_identifier and n.child[1].child[0] == var)
+
+    def alias(value):
+        # the shared array, matrix or map a value refers to, None for a number
+        name = base_name(value)
+        entry = env.lookup(name) if name and name not in local else None
+        if entry is None or isinstance(entry.sym_value, (int, float, str)):
+            return None
+        depth = 0
+        while value.eval in (eval_index, eval_index_counted):
+            depth = depth + 1
+            value = value.child[0]
+        if value.eval == eval_slice or depth < getattr(entry.sym_value, 'ndim', 1):
+            return name
+        return None
+
+    written = []
+    for n in parse_nodes(body):
+        targets = []
+        if n.eval == eval_parfor:
+            return "contains a nested parfor", written
+        elif n.eval == eval_assign:
+            if n.child[1].child[0] in SPECIAL_NAMES:
+                return "uses %s"%(n.child[1].child[0]), written
+            if alias(n.child[1]):
+                # the local would write through to the shared value
+                return "assigns shared %s to %s"%(alias(n.child[1]), n.child[0]), written
+            targets = [ParseNode(eval_identifier, [n.child[0]])]
+        elif n.eval == eval_store:
+            targets = [n.child[0]]
+        elif n.eval == eval_swap:
+            targets = n.child
+        elif n.eval == eval_call:
+            if n.child[0] in ('print', 'read', 'readreal'):
+                return "performs I/O through %s"%(n.child[0]), written
+            f = user_function(n.child[0], env)
+            if f:
+                error, changed = call_writes(f, env)
+                if error:
+                    return "calls %s, which %s"%(n.child[0], error), written
+                for i in changed:
+                    arg = n.child[1 + i] if 1 + i < len(n.child) else None
+                    if arg is not None and (arg.eval != eval_identifier
+                                            or arg.child[0] not in local):
+                        return "passes %s to %s, which writes it"%(
+                            base_name(arg) or "a value", n.child[0]), written
+
+        for target in targets:
+            if target.eval == eval_identifier:
+                if target.child[0] not in local or target.child[0] == var:
+                    return "assigns shared variable %s"%(target.child[0]), written
+            elif node_name(target) in local:
+                # an array declared in the body belongs to this iteration
+                pass
+            elif own_element(target):
+                if node_name(target) not in written:
+                    written.append(node_name(target))
+            else:
+                return "writes %s elements another iteration may write"%(
+                    node_name(target)), written
+
+    for n in parse_nodes(body):
+        if n.eval != eval_identifier or n.child[0] not in written:
+            continue
+        if id(n) not in element:
+            return "uses array %s as a whole"%(n.child[0]), written
+        if not own_element(element[id(n)]):
+            return "reads %s elements another iteration writes"%(
+                n.child[0]), written
+    return None, written
+
+
+def shared_map_writes(var : str, body : ParseNode):
+    """
+    Names of the maps declared outside a parfor body that it puts into or
+    deletes from. Iterations would race on such a map, so the parfor runs
+    serially.
+    """
+    local = {var} | {n.child[1] for n in parse_nodes(body) if n.eval == eval_decl}
+    return [base_name(n.child[1]) for n in parse_nodes(body)
+            if n.eval == eval_call and n.child[0] in ('mapput', 'mapdelete')
+            and len(n.child) > 1 and base_name(n.child[1]) not in local]
+
+
+def parfor_run(body : ParseNode, var : str, indices : range, env : Environment):
+    """
+    Run the parfor body for each index, each iteration in its own scope.
+    """
+    for i in indices:
+        local = Environment(env)
+        try:
+            local.define(var, SymbolTableEntry(SymType.VAR_INT, i))
+            body.eval(body, local)
+        finally:
+            local.release()
+
+
+# the shared state of the parfor a worker process runs chunks of
+parfor_state = None
+
+
+def parfor_init(body : ParseNode, var : str, snapshot, written):
+    """
+    Set up a worker process to run chunks of a parfor, once per worker
+    rather than once per chunk.
+
+    snapshot maps names to the (type, value) pairs visible to the loop.
+    """
+    global parfor_state
+    env = Environment(global_env)
+    for name, (sym_type, value) in snapshot.items():
+        env.define(name, SymbolTableEntry(sym_type, value))
+    parfor_state = (body, var, env, written)
+
+
+def parfor_chunk(indices : range):
+    """
+    Run one chunk of a parfor in a worker process set up by parfor_init.
+    Returns, for each written array, the values of the chunk's elements.
+    """
+    body, var, env, written = parfor_state
+    parfor_run(body, var, indices, env)
+
+    return [env.lookup(name).sym_value[indices.start - 1:indices.stop - 1]
+            for name in written]
+
+
+def eval_parfor(node : ParseNode, env : Environment):
+    """
+    Evaluate a parallel loop. The index range is split into chunks which run
+    on a process pool, then the elements they wrote are merged back.
+
+    child[0] - Loop variable
+    child[1] - Start (inclusive)
+    child[2] - Stop (inclusive)
+    child[3] - Block / Statement
+    """
+    if checkpointer:
+        # a parfor runs to completion before a checkpoint can be taken
+        with checkpointer.opaque_region():
+            return run_parfor(node, env)
+    return run_parfor(node, env)
+
+
+def run_parfor(node : ParseNode, env : Environment):
+    """
+    Dependency check, split and merge for eval_parfor.
+    """
+    var = node.child[0]
+    body = node.child[3]
+    error, written = parfor_dependencies(var, body, env)
+    if error:
+        print("Error: parfor(%s) body %s"%(var, error))
+        return None
+
+    start = node.child[1].eval(node.child[1], env)
+    stop = node.child[2].eval(node.child[2], env)
+    indices = range(start, stop + 1)
+    if len(indices) == 0:
+        return None
+
+    # the written elements must exist before any iteration runs
+    for name in written:
+        array = env.lookup(name).sym_value
+        for i in (start, stop):
+            if i < 1 or i > len(array):
+                print("Error: %s[%d] out of bounds"%(name, i))
+                return None
+
+    workers = PARFOR_WORKERS or os.cpu_count() or 1
+    maps = shared_map_writes(var, body)
+    if maps:
+        logger.info("parfor(%s) runs serially: body changes map %s", var, maps[0])
+    if maps or workers < 2 or len(indices) < PARFOR_MIN_ITERATIONS:
+        parfor_run(body, var, indices, env)
+        return None
+
+    # the workers get copies of the variables and user functions in scope
+    snapshot = {}
+    for name, entry in env.env.items():
+        if entry.sym_type not in (SymType.BUILTIN_INT, SymType.BUILTIN_REAL):
+            snapshot[name] = (entry.sym_type, entry.sym_value)
+
+    size = -(-len(indices) // (workers * 4))
+    chunks = [indices[i:i + size] for i in range(0, len(indices), size)]
+    with ProcessPoolExecutor(workers, initializer=parfor_init,
+                             initargs=(body, var, snapshot, written)) as pool:
+        futures = [pool.submit(parfor_chunk, chunk) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            for name, values in zip(written, future.result()):
+                array = env.lookup(name).sym_value
+                array[chunk.start - 1:chunk.stop - 1] = values
+    return None
 
 
 def eval_block(node : ParseNode, env : Environment):
@@ -110,6 +971,8 @@ def eval_block(node : ParseNode, env : Environment):
 
     The children of the block are the statements
     """
+    if checkpointer:
+        return checkpointer.run_block(node, env)
     for statement in node.child:
         statement.eval(statement, env)
 
@@ -120,12 +983,24 @@ def eval_decl(node : ParseNode, env : Environment):
     
     child[0] - Type
     child[1] - Identifier
+    child[2] - Rows (matrices only)
+    child[3] - Columns (matrices only)
     """
-    if '[' in node.child[1]:
-        n=node.child[1].split('[')
-        iden=n[0]
-        n=n[1].split(']')
-        env.define(iden, SymbolTableEntry(node.child[0], []))
+    if node.child[0] in (SymType.ARRAY_INT, SymType.ARRAY_REAL):
+        env.define(node.child[1], SymbolTableEntry(node.child[0], Array()))
+    elif node.child[0] == SymType.VAR_MAP:
+        env.define(node.child[1], SymbolTableEntry(node.child[0], Map()))
+    elif node.child[0] in (SymType.MATRIX_INT, SymType.MATRIX_REAL):
+        if numpy is None:
+            print("Error: matrix %s needs numpy"%(node.child[1]))
+            return
+        rows = cols = 0
+        if len(node.child) == 4:
+            rows = node.child[2].eval(node.child[2], env)
+            cols = node.child[3].eval(node.child[3], env)
+        dtype = numpy.int64 if node.child[0] == SymType.MATRIX_INT else numpy.float64
+        env.define(node.child[1], SymbolTableEntry(node.child[0],
+            numpy.zeros((rows, cols), dtype)))
     else:
         env.define(node.child[1], SymbolTableEntry(node.child[0], 0))
 
@@ -136,8 +1011,147 @@ def eval_while(node : ParseNode, env : Environment):
     child[0] - Condition
     child[1] - Block / Statement
     """
-    while node.child[0].eval(node.child[0], env):
-        node.child[1].eval(node.child[1], env)
+    loop_while(node, node.child[1], env)
+
+
+def loop_while(node : ParseNode, body : ParseNode, env : Environment):
+    """
+    Run a while loop with the given body, counting iterations and switching
+    to the loop's compiled form once it crosses TIER_LOOP_THRESHOLD.
+    """
+    if checkpointer:
+        return checkpointer.run_while(node, body, env)
+
+    tier = compiled.get(id(node))
+    if tier:
+        return tier[1](env)
+
+    count = loop_counts.get(id(node), 0)
+    try:
+        while node.child[0].eval(node.child[0], env):
+            body.eval(body, env)
+            count = count + 1
+            if TIER_LOOP_THRESHOLD is not None and count >= TIER_LOOP_THRESHOLD:
+                # continue from the current iteration in the compiled loop
+                return tier_up(node, node, "while loop after %d iterations"%(count))(env)
+    finally:
+        loop_counts[id(node)] = count
+
+
+def hoist_bounds_checks(node : ParseNode):
+    """
+    Look for a counted loop of the form
+
+        while(i <= n) begin ... i:=i+1 end
+
+    whose body only indexes arrays as a[i]. The body never changes i, n or
+    a otherwise, and arrays never shrink, so a[i] is in bounds for every
+    iteration if it is for the first and last. Such loops are turned into a
+    counted while that makes that check once on entry, and the a[i] in the
+    body into counted indexes that skip their check while it holds.
+    Returns the original node for any other loop.
+    """
+    condition, body = node.child
+    if condition.eval not in (eval_lt, eval_lte):
+        return node
+    var, bound = condition.child
+    if var.eval != eval_identifier or bound.eval not in (eval_identifier, eval_number):
+        return node
+    var = var.child[0]
+
+    # the last statement must be the only change to the counter
+    statements = body.child if body.eval == eval_block else [body]
+    if len(statements) == 0:
+        return node
+    def is_counter(n):
+        return n.eval == eval_identifier and n.child == [var]
+
+    step = statements[-1]
+    if not (step.eval == eval_assign and step.child[0] == var
+            and step.child[1].eval == eval_plus
+            and is_counter(step.child[1].child[0])
+            and step.child[1].child[1].eval == eval_number
+            and step.child[1].child[1].child == [1]):
+        return node
+
+    fixed = {var}
+    if bound.eval == eval_identifier:
+        fixed.add(bound.child[0])
+    changed = set()
+    for n in parse_nodes(body):
+        if n is step:
+            continue
+        elif n.eval == eval_parfor:
+            return node
+        elif n.eval in (eval_assign, eval_decl):
+            changed.add(n.child[1] if n.eval == eval_decl else n.child[0])
+        elif n.eval == eval_swap:
+            changed.update(t.child[0] for t in n.child if t.eval == eval_identifier)
+    if fixed & changed:
+        return node
+
+    def counted(n):
+        return (n.eval == eval_index and n.child[0].eval == eval_identifier
+                and n.child[0].child[0] not in changed
+                and is_counter(n.child[1]))
+
+    arrays = []
+    for n in parse_nodes(body):
+        if counted(n) and n.child[0].child[0] not in arrays:
+            arrays.append(n.child[0].child[0])
+    if len(arrays) == 0:
+        return node
+
+    # the body is changed in place, so nested counted loops are never copied
+    unchecked = [False]
+    for n in parse_nodes(body):
+        if type(n.child) != list:
+            continue
+        for i, c in enumerate(n.child):
+            if isinstance(c, ParseNode) and counted(c):
+                n.child[i] = c._replace(eval=eval_index_counted,
+                                        child=[c.child[0], c.child[1], unchecked])
+
+    return ParseNode(eval_counted_while, [condition, body, unchecked,
+        var, bound, arrays, condition.eval == eval_lt])
+
+
+def eval_counted_while(node : ParseNode, env : Environment):
+    """
+    Evaluate a counted while loop, see hoist_bounds_checks.
+
+    child[0] - Condition
+    child[1] - Block / Statement
+    child[2] - Cell shared with the counted indexes, [True] while they are
+               known to be in bounds
+    child[3] - Counter
+    child[4] - Bound
+    child[5] - Arrays indexed by the counter
+    child[6] - True if the bound is exclusive
+    """
+    unchecked = node.child[2]
+    saved = unchecked[0]
+    unchecked[0] = counted_in_bounds(node, env)
+    try:
+        loop_while(node, node.child[1], env)
+    finally:
+        # a recursive call may run this loop while an outer run is active
+        unchecked[0] = saved
+
+
+def counted_in_bounds(node : ParseNode, env : Environment):
+    """
+    True if every counted array of a counted while loop holds the elements
+    from the counter up to the bound.
+    """
+    counter = env.lookup(node.child[3])
+    if counter and type(counter.sym_value) == int and counter.sym_value >= 1:
+        last = node.child[4].eval(node.child[4], env) - node.child[6]
+        arrays = [env.lookup(name) for name in node.child[5]]
+        if all(entry and hasattr(entry.sym_value, '__len__')
+               and last <= len(entry.sym_value) for entry in arrays):
+            return True
+    return False
 
 
 def eval_if(node : ParseNode, env : Environment):
@@ -147,6 +1161,8 @@ def eval_if(node : ParseNode, env : Environment):
     child[0] - Condition
     child[1] - Block / Statement
     """
+    if checkpointer:
+        return checkpointer.run_if(node, env)
     if node.child[0].eval(node.child[0], env):
         node.child[1].eval(node.child[1], env)
 
@@ -159,6 +1175,10 @@ def eval_call(node : ParseNode, env : Environment):
     child[1..n] - args
     """
 
+    # a resumed call continues with its saved arguments and environment
+    if checkpointer and checkpointer.resume:
+        return checkpointer.resume_call(node)
+
     # get the parts of the call
     name = node.child[0]
     args = node.child[1:]
@@ -178,23 +1198,92 @@ def eval_call(node : ParseNode, env : Environment):
         return entry.sym_value(args, env)
     elif entry.sym_type in (SymType.FUN_INT, SymType.FUN_REAL):
         f = entry.sym_value
-        params = f.child[2]
-        if len(args) != len(params):
+        if len(args) != len(f.child[2]):
             print("Incorrect number of arguments for %s"%(name))
             return 0
+        return call_function(node, f, args)
+    else:
+        print("Error: %s is not a function!"%(name))
+        return 0
 
-        # create the function's local environment
-        env = Environment(global_env)
+
+def call_function(node : ParseNode, f : ParseNode, args):
+    """
+    Call the user function f with the values of the call node's arguments.
+    """
+    name = f.child[1]
+    if f.child[3].eval == eval_lazy_body:
+        errors = parse_body(f)
+        if errors:
+            raise LazyParseError("body of %s failed to parse with %d errors"%(name, errors))
+
+    # create the function's local environment
+    env = Environment(global_env)
+    try:
         i = 0
-        for t,n in params:
+        for t,n,*dims in f.child[2]:
             env.define(n, SymbolTableEntry(t, args[i]))
             i = i + 1
 
-        # call our function
+        if checkpointer:
+            return checkpointer.run_call(node, f, env)
+
+        # call our function, compiled once it is hot
+        tier = compiled.get(id(f))
+        if tier:
+            return tier[1](env)
+        count = call_counts.get(id(f), 0) + 1
+        call_counts[id(f)] = count
+        if TIER_CALL_THRESHOLD is not None and count >= TIER_CALL_THRESHOLD:
+            return tier_up(f.child[3], f, "function %s after %d calls"%(name, count))(env)
         return f.child[3].eval(f.child[3], env)    
-    else:
-        print("Error: %s is not a function!"%(name))
-        return 0
+    finally:
+        env.release()
+
+
+# Evaluation of nodes that semantic analysis has resolved and checked, so
+# they skip the lookups and checks of their plain forms
+def eval_call_user(node : ParseNode, env : Environment):
+    """
+    Evaluate a checked call to a user function.
+
+    child[0] - Identifier
+    child[1..n] - args
+    """
+    if checkpointer and checkpointer.resume:
+        return checkpointer.resume_call(node)
+    args = [arg.eval(arg, env) for arg in node.child[1:]]
+    return call_function(node, global_env.env.maps[0][node.child[0]].sym_value, args)
+
+
+def eval_call_builtin(node : ParseNode, env : Environment):
+    """
+    Evaluate a checked call to a builtin function.
+
+    child[0] - Identifier
+    child[1..n] - args
+    """
+    args = [arg.eval(arg, env) for arg in node.child[1:]]
+    return global_env.env.maps[0][node.child[0]].sym_value(args, env)
+
+
+def eval_identifier_unchecked(node : ParseNode, env : Environment):
+    """
+    Evaluate a checked identifier.
+    """
+    return env.env[node.child[0]].sym_value
+
+
+def eval_assign_unchecked(node : ParseNode, env : Environment):
+    """
+    Evaluate a checked assignment, never one of the read, insert, rev or
+    bublesort forms.
+    child[0] - identifier
+    child[1] - value
+    """
+    entry = env.env[node.child[0]]
+    entry.sym_value = node.child[1].eval(node.child[1], env)
+    memory.track(entry.sym_value)
 
 
 
@@ -314,6 +1403,14 @@ def eval_number(node : ParseNode, env : Environment):
     return node.child[0] 
 
 
+def eval_string(node : ParseNode, env : Environment):
+    """
+    Evaluate a string literal
+    """
+
+    return node.child[0]
+
+
 def eval_identifier(node : ParseNode, env : Environment):
     """
     Evaluate an identifier.
@@ -340,19 +1437,30 @@ def eval_assign(node : ParseNode, env : Environment):
             #print("Error: %s not defined"%(node.child[0]))
             return None
     
-        entry.sym_value = int(input("read "+node.child[0]+" "))
+        entry.sym_value = int(read_line("read "+node.child[0]+" "))
     elif node.child[1].child[0]=='insert':
         if not entry:
             #print("Error: %s not defined"%(node.child[0]))
             return None
-        ele = int(input("insert n items"))
+        if isinstance(entry.sym_value, ArrayView):
+            # grow a copy of the slice rather than the array it views
+            entry.sym_value = Array(entry.sym_value)
+            memory.track(entry.sym_value)
+        if not isinstance(entry.sym_value, Array):
+            # file-backed arrays and the arrays matrix builtins return have a fixed size
+            print("Error: cannot insert into %s, its size is fixed"%(node.child[0]))
+            return None
+        ele = int(read_line("insert n items"))
         entry.sym_value.append(ele)
+        memory.grow(entry.sym_value, ELEMENT_BYTES)
 
 
     elif node.child[1].child[0]=='bublesort':
-        entry.sym_value=sorted(entry.sym_value)
+        entry.sym_value=Array(sorted(entry.sym_value))
+        memory.track(entry.sym_value)
     elif node.child[1].child[0]=='rev':
-        entry.sym_value=entry.sym_value[::-1]
+        entry.sym_value=Array(entry.sym_value[::-1])
+        memory.track(entry.sym_value)
 
     else:
         expr = node.child[1]
@@ -361,64 +1469,431 @@ def eval_assign(node : ParseNode, env : Environment):
             return None
         #print(node.child[1].child)
         entry.sym_value=expr.eval(expr, env)
+        memory.track(entry.sym_value)
+    return None
+
+
+def eval_index(node : ParseNode, env : Environment):
+    """
+    Evaluate an array element.
+    child[0] - array
+    child[1] - index, counting from 1
+    """
+
+    array, offset = element_ref(node, env)
+    if array is None:
+        return 0
+    return array[offset]
+
+
+def eval_index_counted(node : ParseNode, env : Environment):
+    """
+    Evaluate an array element indexed by the counter of a counted while,
+    without a bounds check while the loop knows it is in bounds.
+    child[0] - array
+    child[1] - index, counting from 1
+    child[2] - the loop's cell, [True] while the index is in bounds
+    """
+
+    if not node.child[2][0]:
+        return eval_index(node, env)
+    array = node.child[0].eval(node.child[0], env)
+    return array[node.child[1].eval(node.child[1], env) - 1]
+
+
+def eval_slice(node : ParseNode, env : Environment):
+    """
+    Evaluate a slice, a view onto the elements from start to stop.
+    child[0] - array
+    child[1] - start, inclusive (None for the first element)
+    child[2] - stop, inclusive (None for the last element)
+    """
+
+    array = node.child[0].eval(node.child[0], env)
+    start = 1
+    stop = len(array)
+    if node.child[1]:
+        start = node.child[1].eval(node.child[1], env)
+    if node.child[2]:
+        stop = node.child[2].eval(node.child[2], env)
+
+    if start > stop:
+        return ArrayView(array, 0, 0)
+    if not check_bounds(array, start, node) or not check_bounds(array, stop, node):
+        return ArrayView(array, 0, 0)
+    return ArrayView(array, start - 1, stop)
+
+
+def eval_store(node : ParseNode, env : Environment):
+    """
+    Evaluate an assignment to an element or slice.
+    child[0] - index or slice
+    child[1] - value
+
+    Assigning to a slice copies an array of the same length into it, or
+    fills it with a single value.
+    """
+
+    target = node.child[0]
+    expr = node.child[1]
+
+    if target.eval != eval_slice:
+        array, offset = element_ref(target, env)
+        if array is not None:
+            array[offset] = expr.eval(expr, env)
+        return None
+
+    view = target.eval(target, env)
+    value = expr.eval(expr, env)
+    if not hasattr(value, '__len__'):
+        value = [value] * len(view)
+    elif len(value) != len(view):
+        print("Error: cannot assign %d elements to a slice of %d"%(len(value), len(view)))
+        return None
+    elif isinstance(value, ArrayView) and value.base is view.base:
+        # overlapping views must not see their own writes
+        value = list(value)
+    view[0:len(view)] = value
     return None
 
 
+def swap_ref(node : ParseNode, env : Environment):
+    """
+    Resolve one side of a swap to a (container, key) pair.
+    Returns (None, None) after printing an error if it does not exist.
+    """
+
+    if node.eval == eval_identifier_unchecked:
+        return vars(env.env[node.child[0]]), 'sym_value'
+    elif node.eval == eval_identifier:
+        entry = env.lookup(node.child[0])
+        if not entry:
+            print("Error: %s not defined"%(node.child[0]))
+            return None, None
+        return vars(entry), 'sym_value'
+    return element_ref(node, env)
+
+
 def eval_swap(node : ParseNode, env : Environment):
     """
-    Evaluate an identifier.
-    child[0] - identifier
-    child[1] - identifier
+    Evaluate a swap.
+    child[0] - identifier or element
+    child[1] - identifier or element
     """
-    
 
-    entry = env.lookup(node.child[0])
-    #print(node.child[1].child[0],entry.sym_value)
-    if not entry:
-        print("Error: %s not defined"%(node.child[0]))
+    left, left_key = swap_ref(node.child[0], env)
+    if left is None:
         return None
-    expr = node.child[1]
-    temp=entry.sym_value
-    #print(entry.sym_value)
-    entry.sym_value = expr.eval(expr, env)
-    
-    entry = env.lookup(node.child[1].child[0])
-    if not entry:
-        print("Error: %s not defined"%(node.child[1]))
+    right, right_key = swap_ref(node.child[1], env)
+    if right is None:
         return None
-    #print(entry.sym_value)
-    entry.sym_value = temp
+    left[left_key], right[right_key] = right[right_key], left[left_key]
     return None
 
+# Tiered execution
+def tier_up(node : ParseNode, key : ParseNode, reason : str):
+    """
+    Compile node and use the result in place of key from now on.
+    Returns the compiled closure.
+    """
+    closure = compile_node(node)
+    compiled[id(key)] = (key, closure)
+    logger.info("tier-up: %s", reason)
+    return closure
+
+
+def compile_node(node : ParseNode):
+    """
+    Compile a parse node into a closure taking the environment. The closure
+    behaves like node.eval(node, env) without the per-node dispatch. Nodes
+    with no compiled form run through their eval function.
+    """
+    compiler = compilers.get(node.eval)
+    if compiler:
+        return compiler(node)
+    return lambda env: node.eval(node, env)
+
+
+def compile_constant(node : ParseNode):
+    value = node.child[0]
+    return lambda env: value
+
+
+def compile_identifier(node : ParseNode):
+    name = node.child[0]
+    def run(env):
+        try:
+            return env.env[name].sym_value
+        except KeyError:
+            print("Error: %s not defined"%(name))
+            return 0
+    return run
+
+
+def compile_binary(op):
+    def compiler(node : ParseNode):
+        left = compile_node(node.child[0])
+        right = compile_node(node.child[1])
+        return lambda env: op(left(env), right(env))
+    return compiler
+
+
+def compile_block(node : ParseNode):
+    statements = [compile_node(statement) for statement in node.child]
+    def run(env):
+        for statement in statements:
+            statement(env)
+    return run
+
+
+def compile_while(node : ParseNode):
+    condition = compile_node(node.child[0])
+    body = compile_node(node.child[1])
+    def run(env):
+        while condition(env):
+            body(env)
+    return run
+
+
+def compile_counted_while(node : ParseNode):
+    condition = compile_node(node.child[0])
+    body = compile_node(node.child[1])
+    unchecked = node.child[2]
+    def run(env):
+        saved = unchecked[0]
+        unchecked[0] = counted_in_bounds(node, env)
+        try:
+            while condition(env):
+                body(env)
+        finally:
+            unchecked[0] = saved
+    return run
+
+
+def compile_if(node : ParseNode):
+    condition = compile_node(node.child[0])
+    body = compile_node(node.child[1])
+    def run(env):
+        if condition(env):
+            body(env)
+    return run
+
+
+def compile_assign(node : ParseNode):
+    # read, insert, rev and bublesort keep their special handling
+    if node.child[1].child[0] in SPECIAL_NAMES:
+        return lambda env: node.eval(node, env)
+    name = node.child[0]
+    expr = compile_node(node.child[1])
+    def run(env):
+        entry = env.lookup(name)
+        if entry:
+            entry.sym_value = expr(env)
+            memory.track(entry.sym_value)
+    return run
+
+
+def compile_assign_unchecked(node : ParseNode):
+    name = node.child[0]
+    expr = compile_node(node.child[1])
+    def run(env):
+        entry = env.env[name]
+        entry.sym_value = expr(env)
+        memory.track(entry.sym_value)
+    return run
+
+
+def compile_index(node : ParseNode):
+    if node.child[0].eval in (eval_index, eval_index_counted):
+        # a matrix element, whose row must be checked before the element
+        return lambda env: node.eval(node, env)
+    array = compile_node(node.child[0])
+    index = compile_node(node.child[1])
+    def run(env):
+        a = array(env)
+        i = index(env)
+        if not check_bounds(a, i, node):
+            return 0
+        return a[i - 1]
+    return run
+
+
+def compile_index_counted(node : ParseNode):
+    array = compile_node(node.child[0])
+    index = compile_node(node.child[1])
+    unchecked = node.child[2]
+    def run(env):
+        a = array(env)
+        i = index(env)
+        if not unchecked[0] and not check_bounds(a, i, node):
+            return 0
+        return a[i - 1]
+    return run
+
+
+compilers = {
+    eval_number: compile_constant,
+    eval_string: compile_constant,
+    eval_identifier: compile_identifier,
+    eval_identifier_unchecked: compile_identifier,
+    eval_lt: compile_binary(operator.lt),
+    eval_lte: compile_binary(operator.le),
+    eval_gt: compile_binary(operator.gt),
+    eval_equal: compile_binary(operator.eq),
+    eval_plus: compile_binary(operator.add),
+    eval_minus: compile_binary(operator.sub),
+    eval_times: compile_binary(operator.mul),
+    eval_divide: compile_binary(operator.truediv),
+    eval_block: compile_block,
+    eval_while: compile_while,
+    eval_counted_while: compile_counted_while,
+    eval_if: compile_if,
+    eval_assign: compile_assign,
+    eval_assign_unchecked: compile_assign_unchecked,
+    eval_index: compile_index,
+    eval_index_counted: compile_index_counted,
+}
+
+
 # interpreter program
 if __name__ == '__main__':
+    import argparse
+    import signal
     import sys
-    file = open(sys.argv[1],'r')    # open file specified on command line
+    import time
+    arg_parser = argparse.ArgumentParser(description="Run a program.")
+    arg_parser.add_argument('file', help="program to run")
+    arg_parser.add_argument('--iterative', action='store_true',
+        help="parse expressions iteratively, for deeply nested generated sources")
+    arg_parser.add_argument('--parallel', type=int, nargs='?', const=0, metavar='WORKERS',
+        help="parse functions in a pool of processes (default one per core)")
+    arg_parser.add_argument('--lazy', action='store_true',
+        help="parse each function body when it is first called")
+    arg_parser.add_argument('--check-bodies', action='store_true',
+        help="with --lazy, parse every body before running")
+    arg_parser.add_argument('--tier-calls', type=int, default=TIER_CALL_THRESHOLD,
+        help="calls before a function is compiled (default %(default)s)")
+    arg_parser.add_argument('--tier-loops', type=int, default=TIER_LOOP_THRESHOLD,
+        help="iterations before a while loop is compiled (default %(default)s)")
+    arg_parser.add_argument('--no-tiering', action='store_true',
+        help="interpret everything")
+    arg_parser.add_argument('--log-tiers', action='store_true',
+        help="log each function or loop as it is compiled")
+    arg_parser.add_argument('--memory-limit', type=int, default=None, metavar='BYTES',
+        help="stop the program once it holds more than this much memory")
+    arg_parser.add_argument('--stats', action='store_true',
+        help="report execution time and peak memory on stderr")
+    arg_parser.add_argument('--check', action='store_true',
+        help="check names, arity and types before running, and run "
+             "programs that pass without the per-access checks")
+    arg_parser.add_argument('--inline', action='store_true',
+        help="inline small functions at their call sites")
+    arg_parser.add_argument('--inline-size', type=int, default=None, metavar='NODES',
+        help="largest function body inlined, in parse nodes")
+    arg_parser.add_argument('--inline-budget', type=float, default=None, metavar='FRACTION',
+        help="growth of the program allowed by inlining")
+    arg_parser.add_argument('--inline-report', action='store_true',
+        help="report each call site considered for inlining on stderr")
+    arg_parser.add_argument('--checkpoint', metavar='FILE',
+        help="save the program's state to FILE on SIGTERM and at intervals")
+    arg_parser.add_argument('--checkpoint-interval', type=float, metavar='SECONDS',
+        help="seconds between checkpoints (default: only on SIGTERM)")
+    arg_parser.add_argument('--resume', metavar='FILE',
+        help="continue the program from a checkpoint")
+    args = arg_parser.parse_args()
+
+    # the parse tree is built from the interpreter module's functions, so
+    # configure and run against that module rather than this script's copy
+    import interpreter
+    interpreter.TIER_CALL_THRESHOLD = None if args.no_tiering else args.tier_calls
+    interpreter.TIER_LOOP_THRESHOLD = None if args.no_tiering else args.tier_loops
+    if args.log_tiers:
+        logging.basicConfig(format="%(message)s", level=logging.INFO)
+    interpreter.memory.cap = args.memory_limit
+
+    # compiled code keeps no execution stack, so checkpointing interprets
+    import checkpoint
+    import semantic
+    if args.checkpoint or args.resume:
+        interpreter.TIER_CALL_THRESHOLD = None
+        interpreter.TIER_LOOP_THRESHOLD = None
+
+    file = open(args.file,'r')    # open file specified on command line
     content=file.read()
     
-    file = open(sys.argv[1],'w+') 
+    file = open(args.file,'w+') 
     file.seek(0)
     file.write("int main()\n"+content)
     file.seek(0)
     
     
-    file = open(sys.argv[1])    # open file specified on command line
+    file = open(args.file)    # open file specified on command line
 
     # create the lexer and the parser
+    status = 0
     try:
         lexer = Lexer(file)
-        parser = Parser(lexer)
+        if args.iterative:
+            parser = IterativeParser(lexer)
+        else:
+            parser = Parser(lexer)
+        if args.parallel is not None:
+            parser = ParallelParser(file.read(), type(parser), args.parallel)
+        parser.lazy = args.lazy
 
-        # try to parse
+        # try to parse, with every body when later passes need them
         parse_tree = parser.parse()
+        if parse_tree and (args.check_bodies or args.check or args.inline
+                           or args.checkpoint or args.resume):
+            parser.errors = interpreter.parse_bodies(parse_tree)
+            parse_tree = parse_tree if parser.errors == 0 else False
+        if parse_tree and args.inline:
+            import inliner
+            report = inliner.inline_program(parse_tree,
+                inliner.INLINE_SIZE if args.inline_size is None else args.inline_size,
+                inliner.INLINE_BUDGET if args.inline_budget is None else args.inline_budget)
+            if args.inline_report:
+                for line in report:
+                    print(line, file=sys.stderr)
+
         if not parse_tree:
             print("Parsing failed with %d errors."%(parser.errors))
+        elif args.check and not semantic.check_program(parse_tree):
+            # the diagnostics have been printed
+            status = 1
         else:
+            # the builtins' entries are not the program's memory
+            interpreter.memory.reset()
+            if args.checkpoint or args.resume:
+                interpreter.checkpointer = checkpoint.Checkpointer(parse_tree,
+                    args.checkpoint or args.resume, args.checkpoint_interval)
+                signal.signal(signal.SIGTERM, interpreter.checkpointer.on_sigterm)
+
             # run our program
-            parse_tree.eval(parse_tree, global_env)
+            start = time.perf_counter()
+            try:
+                if args.resume:
+                    interpreter.checkpointer.load(args.resume)
+                parse_tree.eval(parse_tree, interpreter.global_env)
+            except (interpreter.MemoryLimitError, interpreter.LazyParseError) as error:
+                print("Error: %s"%(error))
+                status = 1
+            except checkpoint.Preempted:
+                print("Checkpoint saved to %s"%(interpreter.checkpointer.path),
+                      file=sys.stderr)
+                status = 143
+            if args.stats:
+                print("time: %.3f s, peak memory: %d bytes"%(
+                    time.perf_counter() - start, interpreter.memory.peak),
+                    file=sys.stderr)
+    except RecursionError:
+        print("Error: program nested too deeply for the interpreter's stack")
+        status = 1
     except:
         pass
 
-    file = open(sys.argv[1],'w+') 
+    file = open(args.file,'w+') 
     file.seek(0)
-    file.write(content)
\ No newline at end of file
+    file.write(content)
+    file.close()
+    sys.exit(status)
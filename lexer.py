@@ -9,6 +9,9 @@ class Token(Enum):
     EOF = auto()
     LPAREN = auto()
     RPAREN = auto()
+    LBRACKET = auto()
+    RBRACKET = auto()
+    COLON = auto()
     COMMA = auto()
     BEGIN = auto()
     END = auto()
@@ -25,21 +28,24 @@ class Token(Enum):
     EQUAL = auto()
     REAL = auto()
     INT = auto()
+    MAP = auto()
     WHILE = auto()
+    PARFOR = auto()
     IF = auto()
     INTNUM = auto()
     REALNUM = auto()
     IDENTIFIER = auto()
+    STRING = auto()
 
 Lexeme = namedtuple("Lexeme", ("token", "lex", "value", "line", "col"))
 
 
 class Lexer:
 
-    def __init__(self, file):
+    def __init__(self, file, line=1, col=0):
         self.file = file
-        self.line = 1
-        self.col = 0
+        self.line = line
+        self.col = col
         self.cur_char = ' '
         self.cur_tok = None
 
@@ -69,6 +75,7 @@ class Lexer:
     def group1(self):
 
         tokens = (('(', Token.LPAREN), (')', Token.RPAREN), 
+                  ('[', Token.LBRACKET), (']', Token.RBRACKET),
                   (',', Token.COMMA),
                   ('+', Token.PLUS), ('-', Token.MINUS),
                   ('*', Token.TIMES), ('/', Token.DIV))
@@ -86,7 +93,8 @@ class Lexer:
 
         tokens = (('<', Token.LT), ('<=', Token.LTE),
                   ('>', Token.GT), ('>=', Token.GTE),
-                  (':=', Token.ASSIGN), ('==', Token.EQUAL),(':=:',Token.SWAP))
+                  (':=', Token.ASSIGN), ('==', Token.EQUAL),(':=:',Token.SWAP),
+                  (':', Token.COLON))
 
         line = self.line
         col = self.col
@@ -124,8 +132,8 @@ class Lexer:
 
     def group3_letter(self):
 
-        tokens = (('while', Token.WHILE), ('real', Token.REAL),
-                  ('int', Token.INT), ('if', Token.IF),('end', Token.END),('END', Token.END),('begin', Token.BEGIN),('BEGIN', Token.BEGIN))
+        tokens = (('while', Token.WHILE), ('parfor', Token.PARFOR), ('real', Token.REAL),
+                  ('int', Token.INT), ('map', Token.MAP), ('if', Token.IF),('end', Token.END),('END', Token.END),('begin', Token.BEGIN),('BEGIN', Token.BEGIN))
 
         line = self.line
         col = self.col
@@ -133,7 +141,7 @@ class Lexer:
         if self.cur_char.isalpha():
             s = s + self.cur_char
             self.consume()
-            while self.cur_char.isalpha() or self.cur_char=='[' or self.cur_char==']' or self.cur_char.isdigit():
+            while self.cur_char.isalpha() or self.cur_char.isdigit():
                 s = s + self.cur_char
                 self.consume()
 
@@ -186,6 +194,78 @@ class Lexer:
         return True
 
 
+    def group4(self):
+
+        if self.cur_char != '"':
+            return False
+
+        line = self.line
+        col = self.col
+
+        s = ''
+        self.consume()
+        while self.cur_char and self.cur_char != '"':
+            s = s + self.cur_char
+            self.consume()
+
+        # unterminated string
+        if not self.cur_char:
+            self.cur_tok = Lexeme(Token.INVALID, '"' + s, None, line, col)
+            return True
+
+        self.consume()
+        self.cur_tok = Lexeme(Token.STRING, '"' + s + '"', s, line, col)
+        return True
+
+
+    def skip_block(self):
+        """
+        Skip to the end matching the begin that is the current token,
+        counting the begin and end words outside strings but making no
+        other tokens. Returns the text from the begin through its end,
+        and leaves end (or EOF, if there is none) as the current token.
+        """
+        text = [self.cur_tok.lex]
+        depth = 1
+        word = ''
+        while self.cur_char:
+            c = self.cur_char
+            if word and (c.isalpha() or c.isdigit()):
+                word = word + c
+            elif c.isalpha():
+                word = c
+            else:
+                word = ''
+
+            if c == '"':
+                # skip the string, an unterminated one runs to the end
+                text.append(c)
+                self.consume()
+                while self.cur_char and self.cur_char != '"':
+                    text.append(self.cur_char)
+                    self.consume()
+                c = self.cur_char
+
+            text.append(c)
+            line = self.line
+            col = self.col
+            self.consume()
+
+            # a whole word ends at a character that cannot continue it
+            if word and not (self.cur_char.isalpha() or self.cur_char.isdigit()):
+                if word in ('begin', 'BEGIN'):
+                    depth = depth + 1
+                elif word in ('end', 'END'):
+                    depth = depth - 1
+                    if depth == 0:
+                        self.cur_tok = Lexeme(Token.END, word, word, line,
+                                              col - len(word) + 1)
+                        return ''.join(text)
+
+        self.cur_tok = Lexeme(Token.EOF, None, None, self.line, self.col)
+        return ''.join(text)
+
+
     def next(self):
 
         self.skip_space()
@@ -200,6 +280,8 @@ class Lexer:
             return self.cur_tok
         elif self.group3():
             return self.cur_tok
+        elif self.group4():
+            return self.cur_tok
         else:
             
             self.cur_tok = Lexeme(Token.INVALID, self.cur_char, None, self.line, self.col)
@@ -0,0 +1,370 @@
+"""
+Semantic analysis of a parsed program.
+
+The analysis resolves every name in every function body and checks:
+- calls against the arity of the function they call
+- each use of a variable against its declaration
+- arrays, matrices and maps against uses that need a number
+- the values stored in elements and swapped, and builtin arguments,
+  against the kinds they need
+
+It prints every problem it finds with its line and column. A program
+with no problems is specialized: its identifiers, assignments and calls
+switch to the unchecked eval functions, which skip the lookups and
+checks this pass has already made.
+
+A declaration is in effect from the statement after it to the end of the
+body it is in, so a variable declared inside an if or while body cannot
+be used after it. Every declaration still binds in the function's one
+environment, so a name cannot be declared again with another kind.
+Parfor bodies are checked but not specialized, since eval_parfor
+analyses their nodes when it runs.
+"""
+import Parser       # loads interpreter in the order its imports need
+import interpreter
+from interpreter import ParseNode, SymType
+
+# the number of arguments each builtin takes, as (least, most)
+BUILTIN_ARITY = {
+    'print': (0, None), 'read': (0, 0), 'readreal': (0, 0),
+    'fileint': (1, 2), 'filereal': (1, 2),
+    'matmul': (2, 2), 'transpose': (1, 1), 'elemadd': (2, 2), 'elemmul': (2, 2),
+    'rowsum': (1, 1), 'colsum': (1, 1), 'fill': (2, 2),
+    'mapget': (2, 2), 'mapput': (3, 3), 'mapcontains': (2, 2),
+    'mapdelete': (2, 2), 'mapsize': (1, 1), 'mapkeys': (1, 1),
+}
+
+# builtins that return an array or a matrix rather than a number
+BUILTIN_KINDS = {
+    'fileint': 'array', 'filereal': 'array', 'mapkeys': 'array',
+    'rowsum': 'array', 'colsum': 'array',
+    'matmul': 'matrix', 'transpose': 'matrix', 'elemadd': 'matrix',
+    'elemmul': 'matrix',
+}
+
+# the kind each builtin needs for each of its arguments, None for any kind
+BUILTIN_PARAMS = {
+    'fileint': ('number', 'number'), 'filereal': ('number', 'number'),
+    'matmul': ('matrix', 'matrix'), 'transpose': ('matrix',),
+    'elemadd': ('matrix', 'matrix'), 'elemmul': ('matrix', 'matrix'),
+    'rowsum': ('matrix',), 'colsum': ('matrix',), 'fill': ('matrix', 'number'),
+    'mapget': ('map', 'number'), 'mapput': ('map', 'number', 'number'),
+    'mapcontains': ('map', 'number'), 'mapdelete': ('map', 'number'),
+    'mapsize': ('map',), 'mapkeys': ('map',),
+}
+
+# the kind of value each variable type holds, and how to name it
+KINDS = {
+    SymType.VAR_INT: 'number', SymType.VAR_REAL: 'number',
+    SymType.ARRAY_INT: 'array', SymType.ARRAY_REAL: 'array',
+    SymType.MATRIX_INT: 'matrix', SymType.MATRIX_REAL: 'matrix',
+    SymType.VAR_MAP: 'map',
+}
+ARTICLES = {'number': 'a number', 'array': 'an array', 'matrix': 'a matrix',
+            'map': 'a map'}
+
+# the binary operators, each of which needs numbers
+OPERATORS = (interpreter.eval_lt, interpreter.eval_lte, interpreter.eval_gt,
+             interpreter.eval_gte, interpreter.eval_equal, interpreter.eval_plus,
+             interpreter.eval_minus, interpreter.eval_times, interpreter.eval_divide)
+
+
+def special(value : ParseNode):
+    """
+    The special form named by the right hand side of an assignment, the
+    way eval_assign tests for it, or None.
+    """
+    if value.child and value.child[0] in interpreter.SPECIAL_NAMES:
+        return value.child[0]
+    return None
+
+
+def describe(node : ParseNode):
+    """
+    Name an expression in a diagnostic.
+    """
+    if node.eval == interpreter.eval_identifier:
+        return node.child[0]
+    if node.eval == interpreter.eval_call:
+        return "%s()"%(node.child[0])
+    if node.eval in (interpreter.eval_index, interpreter.eval_index_counted,
+                     interpreter.eval_slice):
+        return "%s[...]"%(describe(node.child[0]))
+    return "the expression"
+
+
+class Analyzer:
+    """
+    Check the functions of a program and specialize them once they pass.
+
+    diagnostics holds ((line, column), message) pairs in source order.
+    """
+    def __init__(self, tree : ParseNode):
+        self.tree = tree
+        self.diagnostics = []
+
+        # the last definition of a name is the one that gets called
+        self.functions = {}
+        for n in tree.child:
+            if n.eval == interpreter.eval_function_def:
+                self.functions[n.child[1]] = n
+        self.builtins = {name for name, entry in interpreter.global_env.env.items()
+                         if entry.sym_type in (SymType.BUILTIN_INT, SymType.BUILTIN_REAL)}
+
+
+    def error(self, node : ParseNode, message : str):
+        # operators have no position of their own, use their first operand's
+        pos = next((n.pos for n in interpreter.parse_nodes(node) if n.pos),
+                   self.function.pos or (0, 0))
+        self.diagnostics.append((pos, message))
+
+
+    def run(self):
+        """
+        Check every function. Returns the diagnostics.
+        """
+        for f in self.functions.values():
+            self.function = f
+            self.declared = {n.child[1] for n in interpreter.parse_nodes(f.child[3])
+                             if n.eval == interpreter.eval_decl}
+            scope = {n : KINDS[t] for t, n, *dims in f.child[2]}
+            # every declaration binds in the function's one environment
+            self.kinds = dict(scope)
+            self.statement(f.child[3], scope)
+        self.diagnostics.sort(key=lambda d: d[0])
+        return self.diagnostics
+
+
+    def statement(self, node : ParseNode, scope : dict):
+        """
+        Check a statement, adding what it declares to scope.
+        """
+        if node.eval == interpreter.eval_block:
+            for statement in node.child:
+                self.statement(statement, scope)
+        elif node.eval == interpreter.eval_decl:
+            for dim in node.child[2:]:
+                self.number(dim, scope)
+            name = node.child[1]
+            kind = KINDS[node.child[0]]
+            first = self.kinds.setdefault(name, kind)
+            if first != kind:
+                self.error(node, "%s is declared as %s and as %s"%(name,
+                    ARTICLES[first], ARTICLES[kind]))
+            scope[name] = kind
+        elif node.eval == interpreter.eval_assign:
+            self.assign(node, scope)
+        elif node.eval == interpreter.eval_store:
+            self.store(node, scope)
+        elif node.eval == interpreter.eval_swap:
+            left, right = [self.expr(target, scope) for target in node.child]
+            slices = [t for t in node.child if t.eval == interpreter.eval_slice]
+            for target in slices:
+                self.error(target, "%s is a slice and cannot be swapped"%(
+                    describe(target)))
+            if not slices and left and right and left != right:
+                self.error(node, "cannot swap %s, %s, with %s, %s"%(
+                    describe(node.child[0]), ARTICLES[left],
+                    describe(node.child[1]), ARTICLES[right]))
+        elif node.eval in (interpreter.eval_while, interpreter.eval_if,
+                           interpreter.eval_counted_while):
+            self.number(node.child[0], scope)
+            self.statement(node.child[1], dict(scope))
+        elif node.eval == interpreter.eval_parfor:
+            self.number(node.child[1], scope)
+            self.number(node.child[2], scope)
+            body = dict(scope)
+            body[node.child[0]] = 'number'
+            # each iteration runs in an environment of its own
+            kinds = self.kinds
+            self.kinds = dict(body)
+            self.statement(node.child[3], body)
+            self.kinds = kinds
+        else:
+            self.expr(node, scope)
+
+
+    def assign(self, node : ParseNode, scope : dict):
+        name = node.child[0]
+        value = node.child[1]
+        target = self.variable(node, name, scope)
+
+        form = special(value)
+        if form:
+            needed = 'number' if form == 'read' else 'array'
+            if target and target != needed:
+                self.error(node, "%s needs %s, %s is %s"%(form, ARTICLES[needed],
+                    name, ARTICLES[target]))
+            return
+
+        kind = self.expr(value, scope)
+        if target and kind and target != kind:
+            self.error(node, "%s is %s and cannot hold %s"%(name, ARTICLES[target],
+                ARTICLES[kind]))
+
+
+    def store(self, node : ParseNode, scope : dict):
+        target = node.child[0]
+        element = self.expr(target, scope)
+        kind = self.expr(node.child[1], scope)
+        if not element or not kind or kind == element:
+            return
+        # a slice can also be filled with a single value
+        if target.eval == interpreter.eval_slice and kind == 'number':
+            return
+        self.error(node, "%s is %s and cannot hold %s"%(describe(target),
+            ARTICLES[element], ARTICLES[kind]))
+
+
+    def variable(self, node : ParseNode, name : str, scope : dict):
+        """
+        Resolve a variable. Returns its kind, None if it cannot be resolved.
+        """
+        if name in scope:
+            return scope[name]
+        if name in self.declared:
+            self.error(node, "%s used outside or before its declaration"%(name))
+        elif name in self.functions or name in self.builtins:
+            self.error(node, "%s is a function, not a variable"%(name))
+        else:
+            self.error(node, "%s not declared"%(name))
+        return None
+
+
+    def number(self, node : ParseNode, scope : dict):
+        """
+        Check an expression used where a number is needed.
+        """
+        kind = self.expr(node, scope)
+        if kind and kind != 'number':
+            self.error(node, "%s is %s where a number is needed"%(describe(node),
+                ARTICLES[kind]))
+
+
+    def expr(self, node : ParseNode, scope : dict):
+        """
+        Check an expression. Returns the kind of its value, None if unknown.
+        """
+        if node.eval in (interpreter.eval_number, interpreter.eval_string):
+            return 'number'
+        elif node.eval == interpreter.eval_identifier:
+            return self.variable(node, node.child[0], scope)
+        elif node.eval == interpreter.eval_call:
+            return self.call(node, scope)
+        elif node.eval in (interpreter.eval_index, interpreter.eval_index_counted):
+            base = self.expr(node.child[0], scope)
+            self.number(node.child[1], scope)
+            return self.element(node.child[0], base, {'array': 'number',
+                                                      'matrix': 'array'})
+        elif node.eval == interpreter.eval_slice:
+            base = self.expr(node.child[0], scope)
+            for bound in node.child[1:]:
+                if bound:
+                    self.number(bound, scope)
+            return self.element(node.child[0], base, {'array': 'array',
+                                                      'matrix': 'matrix'})
+        elif node.eval in OPERATORS:
+            for operand in node.child:
+                self.number(operand, scope)
+            return 'number'
+        return None
+
+
+    def element(self, base : ParseNode, kind, kinds : dict):
+        """
+        Check that base, of the given kind, can be indexed.
+        Returns the kind of its elements from kinds.
+        """
+        if kind in kinds:
+            return kinds[kind]
+        if kind == 'map':
+            self.error(base, "%s is a map, use mapget"%(describe(base)))
+        elif kind:
+            self.error(base, "%s is %s and cannot be indexed"%(describe(base),
+                ARTICLES[kind]))
+        return None
+
+
+    def call(self, node : ParseNode, scope : dict):
+        """
+        Check a call. Returns the kind of its value, None if unknown.
+        """
+        name = node.child[0]
+        args = node.child[1:]
+        kinds = [self.expr(arg, scope) for arg in args]
+
+        if name in scope:
+            self.error(node, "%s is a variable, not a function"%(name))
+        elif name in self.functions:
+            params = self.functions[name].child[2]
+            if len(args) != len(params):
+                self.error(node, "%s takes %d arguments, not %d"%(name,
+                    len(params), len(args)))
+                return None
+            self.arguments(name, args, kinds, [KINDS[p[0]] for p in params])
+        elif name in self.builtins:
+            least, most = BUILTIN_ARITY.get(name, (0, None))
+            if len(args) < least or (most is not None and len(args) > most):
+                if most is None:
+                    takes = "at least %d"%(least)
+                elif least == most:
+                    takes = "%d"%(least)
+                else:
+                    takes = "%d to %d"%(least, most)
+                self.error(node, "%s takes %s arguments, not %d"%(name, takes,
+                    len(args)))
+            self.arguments(name, args, kinds, BUILTIN_PARAMS.get(name, ()))
+            return BUILTIN_KINDS.get(name, 'number')
+        else:
+            self.error(node, "function %s not defined"%(name))
+        return None
+
+
+    def arguments(self, name : str, args : list, kinds : list, needed):
+        """
+        Check the kinds of the arguments of a call against the kinds its
+        function needs.
+        """
+        for i, (arg, kind, need) in enumerate(zip(args, kinds, needed)):
+            if kind and need and kind != need:
+                self.error(arg, "argument %d of %s is %s, not %s"%(i + 1,
+                    name, ARTICLES[kind], ARTICLES[need]))
+
+
+    def specialize(self, node : ParseNode):
+        """
+        Return node with its checked nodes switched to unchecked evaluation.
+        """
+        if node.eval == interpreter.eval_parfor:
+            return node
+
+        child = [self.specialize(c) if isinstance(c, ParseNode) else c
+                 for c in node.child]
+        node = node._replace(child=type(node.child)(child))
+        if node.eval == interpreter.eval_identifier:
+            return node._replace(eval=interpreter.eval_identifier_unchecked)
+        elif node.eval == interpreter.eval_assign and not special(node.child[1]):
+            return node._replace(eval=interpreter.eval_assign_unchecked)
+        elif node.eval == interpreter.eval_call and node.child[0] in self.functions:
+            return node._replace(eval=interpreter.eval_call_user)
+        elif node.eval == interpreter.eval_call and node.child[0] in self.builtins:
+            return node._replace(eval=interpreter.eval_call_builtin)
+        return node
+
+
+def check_program(tree : ParseNode):
+    """
+    Check a parsed program, printing every diagnostic. A program that
+    passes is specialized in place and True is returned.
+    """
+    analyzer = Analyzer(tree)
+    diagnostics = analyzer.run()
+    for (line, col), message in diagnostics:
+        print("Error: %s at Line %d Column %d"%(message, line, col))
+    if diagnostics:
+        print("Semantic check failed with %d errors."%(len(diagnostics)))
+        return False
+
+    for f in analyzer.functions.values():
+        f.child[3] = analyzer.specialize(f.child[3])
+    return True
@@ -0,0 +1,114 @@
+"""
+Check that Parser, IterativeParser and ParallelParser build the same trees.
+
+    python -m unittest test_parser
+"""
+import io
+import os
+import unittest
+
+from Parser import Parser, IterativeParser, ParallelParser
+from lexer import Lexer
+from bench_parser import generate
+import interpreter
+
+SAMPLES = ('array.fun', 'bublesort.fun', 'count.fun')
+
+# a program using every kind of statement and expression
+FEATURES = """
+int main()
+begin
+    int n
+    int i
+    int j
+    int a[10]
+    int m[2][3]
+    real r
+    map k
+    n := 4
+    i := 1
+    while(i <= n)
+    begin
+        a := insert
+        j := 1
+        while(j < n)
+        begin
+            a[j] := a[j] + a[i] * (j - 1) / 2
+            j := j + 1
+        end
+        i := i + 1
+    end
+    a[1] :=: a[n]
+    a[2:3] := a[:2]
+    m[1][2] := a[n - 1]
+    parfor(p, 1, n)
+        a[p] := a[p] * 2
+    if(a[1] >= 2) print("big", a[1:], m)
+    mapput(k, 1, r)
+    show(a, mapget(k, 1) == 0)
+end
+
+real show(int b[], int flag)
+begin
+    print(b[flag + 1], rowsum(transpose(matmul(b, b))))
+end
+"""
+
+
+def parse(parser_class, text):
+    return parser_class(Lexer(io.StringIO(text))).parse()
+
+
+class ParserEquivalenceTest(unittest.TestCase):
+    def sources(self):
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in SAMPLES:
+            with open(os.path.join(here, name)) as file:
+                # the interpreter runs a program file as the body of main
+                yield name, "int main()\n" + file.read()
+        yield 'features', FEATURES
+        buffer = io.StringIO()
+        generate(buffer, 20000, 40)
+        yield 'generated', buffer.getvalue()
+
+
+    def test_iterative(self):
+        for name, text in self.sources():
+            with self.subTest(name):
+                tree = parse(Parser, text)
+                self.assertTrue(tree)
+                self.assertEqual(parse(IterativeParser, text), tree)
+
+
+    def test_parallel(self):
+        for name, text in self.sources():
+            tree = parse(Parser, text)
+            for parser_class in (Parser, IterativeParser):
+                for workers in (1, 2):
+                    with self.subTest(name, parser=parser_class.__name__, workers=workers):
+                        parser = ParallelParser(text, parser_class, workers)
+                        self.assertEqual(parser.parse(), tree)
+
+
+    def test_lazy(self):
+        for name, text in self.sources():
+            with self.subTest(name):
+                parser = Parser(Lexer(io.StringIO(text)))
+                parser.lazy = True
+                lazy = parser.parse()
+                self.assertTrue(lazy)
+                self.assertEqual(interpreter.parse_bodies(lazy), 0)
+                self.assertEqual(lazy, parse(Parser, text))
+
+
+    def test_deep_expression_in_loop(self):
+        depth = 3000
+        text = ("int main()\nbegin\n    int x\n    int i\n    int a[]\n    i := 1\n"
+                "    while(i <= 2)\n    begin\n        x := " + "(" * depth + "i"
+                + "+1)" * depth + "\n        a[i] := x\n        i := i + 1\n"
+                "    end\nend\n")
+        self.assertTrue(parse(IterativeParser, text))
+
+
+if __name__ == '__main__':
+    unittest.main()
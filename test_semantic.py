@@ -0,0 +1,171 @@
+"""
+Check the semantic pass: the programs it accepts and the diagnostics it
+gives for the ones it rejects, and that a checked program, which runs
+through the unchecked eval functions, prints what it prints unchecked.
+
+    python -m unittest test_semantic
+"""
+import io
+import os
+import sys
+import unittest
+from contextlib import redirect_stdout
+
+from Parser import Parser
+from lexer import Lexer
+import interpreter
+import semantic
+
+SAMPLES = ('array.fun', 'bublesort.fun', 'count.fun')
+
+# input for the programs, one number per line
+INPUT = "".join("%d\n"%(i) for i in (3, 1, 4, 1, 5, 9, 2, 6, 5, 3))
+
+# a program using every kind of statement the pass checks
+FEATURES = """
+int main()
+begin
+    int n
+    int i
+    int a[]
+    int b[]
+    map k
+    int m[2][3]
+    n := 5
+    i := 1
+    while(i <= n)
+    begin
+        a := insert
+        i := i + 1
+    end
+    b := a[2:4]
+    b := rev
+    a[1] :=: a[n]
+    a[2:3] := 0
+    i := 1
+    while(i <= n)
+    begin
+        int t
+        t := a[i] * 2
+        mapput(k, i, t)
+        i := i + 1
+    end
+    parfor(p, 1, n)
+    begin
+        real x
+        x := a[p] / 2
+        a[p] := a[p] + x
+    end
+    fill(m, 7)
+    m[1][2] := mapget(k, 2)
+    total(a, n)
+    print(mapsize(k), mapcontains(k, 9))
+    print(b)
+    print(m)
+    print(rowsum(m))
+end
+
+int total(int v[], int len)
+begin
+    int j
+    int s
+    s := 0
+    j := 1
+    while(j <= len)
+    begin
+        s := s + v[j]
+        j := j + 1
+    end
+    print(s)
+end
+"""
+
+# statements that fail the check, each with the diagnostics it gets when
+# it follows these declarations in the body of main
+DECLS = """
+    int x
+    int a[]
+    int m[2][2]
+    map k
+"""
+REJECTED = [
+    ("a[1] := a", ["a[...] is a number and cannot hold an array"]),
+    ("m[1] := x", ["m[...] is an array and cannot hold a number"]),
+    ("x := a", ["x is a number and cannot hold an array"]),
+    ("a := read", ["read needs a number, a is an array"]),
+    ("x := insert", ["insert needs an array, x is a number"]),
+    ("mapget(a, 1)", ["argument 1 of mapget is an array, not a map"]),
+    ("fill(a, 0)", ["argument 1 of fill is an array, not a matrix"]),
+    ("mapput(k, 1)", ["mapput takes 3 arguments, not 2"]),
+    ("x :=: a", ["cannot swap x, a number, with a, an array"]),
+    ("x := a + 1", ["a is an array where a number is needed"]),
+    ("x := x[1]", ["x is a number and cannot be indexed"]),
+    ("x := k[1]", ["k is a map, use mapget"]),
+    ("y := 1", ["y not declared"]),
+    ("if(x) begin int z end\n    z := 1", ["z used outside or before its declaration"]),
+    ("if(x) begin int x[] end", ["x is declared as a number and as an array"]),
+    ("x := main", ["main is a function, not a variable"]),
+    ("x()", ["x is a variable, not a function"]),
+    ("g(1)", ["function g not defined"]),
+    ("f(1, 2)", ["f takes 1 arguments, not 2"]),
+    ("f(a)", ["argument 1 of f is an array, not a number"]),
+]
+
+
+def parse(text):
+    return Parser(Lexer(io.StringIO(text))).parse()
+
+
+def run(tree):
+    """
+    Run a parsed program on INPUT. Returns what it printed.
+    """
+    output = io.StringIO()
+    stdin = sys.stdin
+    sys.stdin = io.StringIO(INPUT)
+    try:
+        with redirect_stdout(output):
+            tree.eval(tree, interpreter.global_env)
+    finally:
+        sys.stdin = stdin
+    return output.getvalue()
+
+
+class SemanticTest(unittest.TestCase):
+    def sources(self):
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in SAMPLES:
+            with open(os.path.join(here, name)) as file:
+                # the interpreter runs a program file as the body of main
+                yield name, "int main()\n" + file.read()
+        yield 'features', FEATURES
+
+
+    def test_accepted(self):
+        for name, text in self.sources():
+            with self.subTest(name):
+                self.assertEqual(semantic.Analyzer(parse(text)).run(), [])
+
+
+    def test_rejected(self):
+        for statement, expected in REJECTED:
+            text = ("int main()\nbegin" + DECLS + "    " + statement
+                    + "\nend\n\nint f(int p)\nbegin\n    print(p)\nend\n")
+            with self.subTest(statement):
+                diagnostics = semantic.Analyzer(parse(text)).run()
+                self.assertEqual([message for pos, message in diagnostics], expected)
+
+
+    def test_same_output(self):
+        for name, text in self.sources():
+            with self.subTest(name):
+                expected = run(parse(text))
+                tree = parse(text)
+                self.assertTrue(semantic.check_program(tree))
+                self.assertTrue(any(n.eval == interpreter.eval_identifier_unchecked
+                                    for n in interpreter.parse_nodes(tree)))
+                self.assertEqual(run(tree), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()